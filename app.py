@@ -1,14 +1,30 @@
 import os
 import time
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as StageTimeout
+from datetime import datetime, timezone
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import firebase_admin
 from firebase_admin import credentials, firestore
-import cloudinary
-import cloudinary.uploader
 
 # --- Import chatbot logic ---
 import chatbot_logic
+from catalog_cache import CatalogCache, SORT_FIELDS
+from cloudinary_utils import UploadQueue
+from inference_pool import InferencePool, PoolBusy, InferenceTimeout
+from response_cache import SemanticResponseCache
+from history_writer import HistoryWriter
+from index_sync import ProductIndexSync
+from micro_batcher import MicroBatcher
+import metrics
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+import query_filters
+from intent_router import IntentRouter, PRODUCT_LOOKUP
+import degradation
+from degradation import DegradationPolicy, LEVEL_NAMES
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
@@ -20,108 +36,411 @@ firebase_admin.initialize_app(cred, {
 })
 db = firestore.client()
 
-# --- Cloudinary Configuration ---
-try:
-    cloudinary.config( 
-      cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME', 'dskef0sp7'), 
-      api_key = os.getenv('CLOUDINARY_API_KEY', '393697419565677'), 
-      api_secret = os.getenv('CLOUDINARY_API_SECRET', 'jAt6l0ZYCHhQSoWymLRcu5Fl5Fo'), 
-      secure = True
-    )
-    print("✅ Cloudinary initialized")
-except Exception as e:
-    print(f"❌ Cloudinary failed to initialize: {e}")
+# --- Write-behind chat history (batched Firestore writes off the request thread) ---
+history_writer = HistoryWriter(db)
 
-def upload_file_to_cloudinary(file):
-    """
-    Uploads a file stream directly to Cloudinary and returns the public URL.
-    """
-    try:
-        file.seek(0)
-        upload_result = cloudinary.uploader.upload(
-            file,
-            folder = "ecom_products",
-            resource_type = "auto"
-        )
-        return upload_result.get("secure_url")
-    except Exception as e:
-        print(f"Error uploading file to Cloudinary: {e}")
-        return None
+# --- In-memory product catalog (kept fresh by a Firestore snapshot listener; seeded in the background) ---
+product_catalog = CatalogCache(db).start(wait=False)
+
+# --- Background image uploads (Cloudinary) ---
+image_uploads = UploadQueue(workers=int(os.getenv("UPLOAD_WORKERS", "2")))
+
+# --- RAG index and LLM are loaded in the background (see warm_up); chat answers 503 until ready ---
+rag_collection = None
+
+# --- Inference scheduler: one worker thread per model replica, bounded queue ---
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "1"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "8"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "120"))
+llm_replicas = []
+inference_pool = None
+
+# --- Load-adaptive degradation: shorter replies -> no RAG -> small GGUF -> templated only ---
+DEFAULT_MAX_TOKENS = 512
+SHORT_REPLY_MAX_TOKENS = int(os.getenv("SHORT_REPLY_MAX_TOKENS", "192"))
+small_inference_pool = None   # only when SMALL_LLM_PATH is set
+degradation_policy = DegradationPolicy(
+    queue_thresholds=[float(x) for x in os.getenv("DEGRADE_QUEUE_THRESHOLDS", "0.25,0.5,0.75,0.9").split(",")],
+    cooldown_s=float(os.getenv("DEGRADE_COOLDOWN_S", "10")),
+    unavailable={degradation.SMALL_MODEL},
+)
+
+# --- Retrieval micro-batching: concurrent chat turns share embedding and query calls ---
+RETRIEVAL_MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "32"))
+RETRIEVAL_WINDOW_MS = float(os.getenv("RETRIEVAL_WINDOW_MS", "3"))
+embed_batcher = MicroBatcher(
+    chatbot_logic.embed_queries, max_batch=RETRIEVAL_MAX_BATCH, max_wait_ms=RETRIEVAL_WINDOW_MS, name="embed-batcher"
+)
+rag_batcher = MicroBatcher(
+    lambda embeddings: (
+        chatbot_logic.rag_query_chunks_batch(rag_collection, embeddings, k=4)
+        if rag_collection is not None else [[] for _ in embeddings]
+    ),
+    max_batch=RETRIEVAL_MAX_BATCH, max_wait_ms=RETRIEVAL_WINDOW_MS, name="rag-batcher"
+)
+product_query_batcher = MicroBatcher(
+    lambda requests: chatbot_logic.product_index_query_grouped(product_coll, requests),
+    max_batch=RETRIEVAL_MAX_BATCH, max_wait_ms=RETRIEVAL_WINDOW_MS, name="product-query-batcher"
+)
+
+# --- Chat stage fan-out: independent retrieval stages run concurrently, each with a deadline ---
+chat_stage_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_STAGE_WORKERS", "16")), thread_name_prefix="chat-stage"
+)
+STAGE_DEADLINES_S = {
+    "products": float(os.getenv("PRODUCT_STAGE_DEADLINE_S", "2.0")),
+    "rag": float(os.getenv("RAG_STAGE_DEADLINE_S", "1.5")),
+}
+
+def embed_texts(texts):
+    """Embed through the shared batcher so concurrent requests are embedded together."""
+    futures = [embed_batcher.submit(t) for t in texts]
+    return [f.result() for f in futures]
 
-# --- Load LLM and RAG models into memory ---
-print("🔧 Building/Loading RAG…")
-rag_collection = chatbot_logic.build_rag_if_missing()
-print("🧠 Loading LLM…")
-llm_model = chatbot_logic.load_llm() 
-print("✅ Models loaded. Starting Flask app...")
+# --- Semantic response cache for near-duplicate chat questions ---
+response_cache = SemanticResponseCache(
+    embed_texts,
+    threshold=float(os.getenv("CHAT_CACHE_THRESHOLD", "0.92")),
+    max_entries=int(os.getenv("CHAT_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("CHAT_CACHE_TTL_S", "3600")),
+)
+# --- Intent router: plain product lookups are answered from the matches, without the LLM ---
+intent_router = None
+if os.getenv("INTENT_ROUTER", "1") == "1":
+    intent_router = IntentRouter(
+        embed_texts,
+        min_similarity=float(os.getenv("INTENT_MIN_SIMILARITY", "0.6")),
+        margin=float(os.getenv("INTENT_MARGIN", "0.03")),
+    )
 
 # --- GLOBAL PRODUCT COLLECTION (for chromadb semantic search) ---
 product_coll = None
 
+# --- In-memory BM25 index over the catalog (exact-name fast path + hybrid ranking) ---
+lexical_index = LexicalIndex()
+
+# --- Prometheus metrics (served on /metrics) ---
+metrics_registry = metrics.Registry()
+CHAT_REQUESTS = metrics_registry.counter(
+    "chat_requests_total", "Chat requests by endpoint and outcome.", ("endpoint", "outcome")
+)
+CHAT_LATENCY = metrics_registry.histogram(
+    "chat_request_seconds", "End-to-end chat request latency.", ("endpoint",)
+)
+CHAT_STAGE = metrics_registry.histogram(
+    "chat_stage_seconds", "Latency of each chat pipeline stage.", ("stage",)
+)
+LLM_PROMPT_TOKENS = metrics_registry.counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM.")
+LLM_COMPLETION_TOKENS = metrics_registry.counter("llm_completion_tokens_total", "Tokens generated by the LLM.")
+LLM_TOKENS_PER_SEC = metrics_registry.histogram(
+    "llm_tokens_per_second", "Generation speed per reply (completion tokens / generation time).",
+    buckets=(1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128),
+)
+
+def _collection_size(coll):
+    return coll.count() if coll is not None else None
+
+metrics_registry.gauge("catalog_products", "Products in the in-memory catalog.", lambda: len(product_catalog))
+metrics_registry.gauge("product_index_items", "Items in the product semantic index.", lambda: _collection_size(product_coll))
+metrics_registry.gauge("lexical_index_documents", "Products in the BM25 lexical index.", lambda: len(lexical_index))
+CHAT_INTENT = metrics_registry.counter(
+    "chat_intent_total", "Chat turns by routed intent and whether the LLM was used.", ("intent", "llm")
+)
+STAGE_DEGRADED = metrics_registry.counter(
+    "chat_stage_degraded_total", "Chat stages dropped because they missed their deadline or failed.", ("stage", "reason")
+)
+DEGRADATION_REPLIES = metrics_registry.counter(
+    "chat_degradation_total", "Chat turns by the degradation level they were served at.", ("level",)
+)
+metrics_registry.gauge("chat_degradation_level", "Current load-adaptive degradation level (0 = normal).", lambda: degradation_policy.level)
+PRODUCT_SEARCH_PATH = metrics_registry.counter(
+    "product_search_total", "Product searches by retrieval path (exact lexical match or hybrid).", ("path",)
+)
+metrics_registry.gauge("rag_index_chunks", "Chunks in the RAG document index.", lambda: _collection_size(rag_collection))
+metrics_registry.gauge(
+    "inference_queue_depth", "Chat jobs waiting for an LLM worker.", lambda: inference_pool.stats()["queue_depth"]
+)
+metrics_registry.gauge(
+    "inference_busy_workers", "LLM workers currently generating.", lambda: inference_pool.stats()["busy_workers"]
+)
+metrics_registry.gauge(
+    "inference_jobs_total", "Inference pool jobs by outcome.",
+    lambda: {k: v for k, v in inference_pool.stats().items() if k in ("submitted", "completed", "failed", "rejected", "timeouts")},
+    ("outcome",), type="counter",
+)
+metrics_registry.gauge(
+    "response_cache_events_total", "Semantic response cache lookups and evictions by kind.",
+    lambda: {k: v for k, v in response_cache.stats().items() if k in ("hits", "exact_hits", "misses", "evictions", "expirations", "invalidations")},
+    ("event",), type="counter",
+)
+metrics_registry.gauge("response_cache_entries", "Replies held in the semantic response cache.", lambda: response_cache.stats()["size"])
+metrics_registry.gauge("chat_history_buffered", "Chat messages waiting to be written to Firestore.", lambda: history_writer.stats()["buffered"])
+metrics_registry.gauge(
+    "retrieval_batch_items_total", "Items processed by the retrieval micro-batchers.",
+    lambda: {"embed": embed_batcher.stats()["items"], "rag": rag_batcher.stats()["items"], "products": product_query_batcher.stats()["items"]},
+    ("batcher",), type="counter",
+)
+
 def fetch_all_products():
-    """Return list of product dicts from Firestore (includes id as 'id')."""
-    prods = []
+    """Return list of product dicts from the in-memory catalog (includes id as 'id')."""
+    return product_catalog.all()
+
+def catalog_version():
+    """Monotonic version of the product catalog; changes whenever any product changes."""
+    return product_catalog.version
+
+MAX_PAGE_SIZE = 200
+
+def read_page_args(default_limit=24):
+    """
+    Pagination query args shared by /home and the product APIs:
+    limit, cursor, sort (name|price|created) and order (asc|desc).
+    Raises ValueError on bad input.
+    """
     try:
-        for doc in db.collection("products").stream():
-            d = doc.to_dict() or {}
-            d["id"] = doc.id
-            prods.append(d)
-    except Exception as e:
-        print("Failed to fetch products for index build:", e)
-    return prods
+        limit = int(request.args.get("limit", default_limit))
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    sort = request.args.get("sort", "name")
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    return {
+        "limit": max(1, min(limit, MAX_PAGE_SIZE)),
+        "cursor": request.args.get("cursor") or None,
+        "sort": sort,
+        "descending": request.args.get("order", "asc") == "desc",
+    }
 
 def detect_filters_from_query(q: str):
-    """Simple heuristics to detect metadata filters from user query."""
-    if not q:
+    """Price range, category, gender, stock and color filters mentioned in the query."""
+    return query_filters.parse_query_filters(
+        q, categories=product_catalog.categories(), colors=product_catalog.distinct("color")
+    )
+
+def plan_filters(filters):
+    """
+    Loosest-useful filter set: walk the relaxation order (color, stock, gender,
+    category, price) against the in-memory catalog and keep the first set that
+    still matches a product, so the index is queried once instead of filtered + unfiltered.
+    """
+    for candidate in query_filters.relaxations(filters):
+        if not candidate or product_catalog.has_match(**query_filters.to_facets(candidate)):
+            return candidate
+    return {}
+
+def lexical_result(pid):
+    """A catalog product shaped like a product_index_query result."""
+    p = product_catalog.get(pid)
+    if p is None:
         return None
-    ql = q.lower()
-    where = {}
-    if any(tok in ql for tok in ["men", "men's", "mens", "male", "for men", "for a man"]):
-        where["gender"] = "male"
-    elif any(tok in ql for tok in ["women", "women's", "womens", "female", "for women", "for a woman"]):
-        where["gender"] = "female"
-    return where or None
-
-def get_product_recommendations(user_input, top_k=6):
+    meta = {k: p.get(k) for k in ("name", "category", "price", "image", "gender", "color", "in_stock") if k in p}
+    return {"id": pid, "meta": meta, "distance": None}
+
+def lexical_matches(user_input, filters, k):
+    """BM25 candidates (ids, best first) that pass the filters."""
+    accept = None
+    if filters:
+        accept = lambda pid: query_filters.product_matches(product_catalog.get(pid) or {}, filters)
+    return [pid for pid, _ in lexical_index.search(user_input, k=k, accept=accept)]
+
+def fuse_results(vector_results, lexical_ids, top_k):
+    """Reciprocal rank fusion of the vector and BM25 rankings."""
+    by_id = {r["id"]: r for r in vector_results}
+    out = []
+    for pid in reciprocal_rank_fusion([[r["id"] for r in vector_results], lexical_ids]):
+        r = by_id.get(pid) or lexical_result(pid)
+        if r is not None:
+            out.append(r)
+        if len(out) == top_k:
+            break
+    return out
+
+def exact_product_matches(user_input, filters=None, top_k=6):
     """
-    Query chroma product index for semantically similar products with optional metadata filtering.
-    Returns a formatted context string for the LLM.
+    Products whose name / SKU is exactly the query (lexical index, no embedding).
+    filters: planned query filters; planned here when None. [] when the query isn't a product name.
     """
-    global product_coll
+    ids = lexical_index.exact(user_input)
+    if not ids:
+        return []
+    if filters is None:
+        filters = plan_filters(detect_filters_from_query(user_input))
+    ids = [pid for pid in ids if query_filters.product_matches(product_catalog.get(pid) or {}, filters)]
+    if ids:
+        PRODUCT_SEARCH_PATH.inc(path="exact")
+    return [r for r in map(lexical_result, ids[:top_k]) if r is not None]
+
+def find_product_matches(user_input, top_k=6, query_embedding=None):
+    """
+    Hybrid product search with structured filters pushed down into the index query.
+    A query that is exactly a product name / SKU is answered from the lexical index
+    without embedding or vector search; otherwise vector and BM25 rankings are fused.
+    query_embedding: precomputed vector for user_input, shared across all index queries of a turn.
+    Returns ranked list of {id, meta, distance}.
+    """
+    # detect filters from user query, relaxed until something in the catalog matches
+    with CHAT_STAGE.time(stage="filter_planning"):
+        filters = plan_filters(detect_filters_from_query(user_input))
+        where = query_filters.to_where(filters)
+
+    with CHAT_STAGE.time(stage="lexical_search"):
+        exact = exact_product_matches(user_input, filters, top_k)
+        if exact:
+            return exact
+        lexical_ids = lexical_matches(user_input, filters, top_k * 2)
+
     if product_coll is None:
-        return ""
+        # Semantic index still loading: lexical ranking only
+        return fuse_results([], lexical_ids, top_k)
 
-    # detect filters from user query
-    where = detect_filters_from_query(user_input)
+    PRODUCT_SEARCH_PATH.inc(path="hybrid")
+    if query_embedding is None:
+        with CHAT_STAGE.time(stage="embed"):
+            query_embedding = embed_batcher(user_input)
 
-    # primary semantic query with filters
-    results = chatbot_logic.product_index_query(product_coll, user_input, n_results=top_k, where=where)
-    
-    # fallback: try without filters if filtered query returned nothing
-    if not results and where:
-        results = chatbot_logic.product_index_query(product_coll, user_input, n_results=top_k, where=None)
+    # one semantic query with the planned filters (micro-batched with concurrent requests)
+    with CHAT_STAGE.time(stage="product_retrieval"):
+        results = product_query_batcher((query_embedding, where, top_k))
 
-    if not results:
-        return ""
+    return fuse_results(results, lexical_ids, top_k)
 
-    # format to context for LLM
-    ctx_lines = ["Product Catalog Matches:"]
+def product_context_lines(results):
+    """One context line per product match, in ranked order."""
+    lines = []
     for r in results:
         meta = r.get("meta", {})
         name = meta.get("name", "Unknown")
         price = meta.get("price", "")
         category = meta.get("category", "")
-        ctx_lines.append(f"- Name: {name} | Price: RM{price} | Category: {category}")
-    
-    return "\n".join(ctx_lines)
+        lines.append(f"- Name: {name} | Price: RM{price} | Category: {category}")
+    return lines
+
+def get_product_recommendations(user_input, top_k=6, query_embedding=None):
+    """Product matches formatted as a context string for the LLM."""
+    lines = product_context_lines(find_product_matches(user_input, top_k, query_embedding))
+    if not lines:
+        return ""
+    return "\n".join(["Product Catalog Matches:"] + lines)
+
+# Catalog changes are applied to the semantic index in batches, off the listener thread
+product_index_sync = ProductIndexSync(lambda: product_coll)
+
+# Admin edits and listener updates flow through the catalog cache into the indexes
+product_catalog.subscribe(product_index_sync.on_catalog_change)
+product_catalog.subscribe(lexical_index.on_catalog_change)
+
+# ---------- Background warm-up ----------
+CATALOG_SEED_TIMEOUT_S = float(os.getenv("CATALOG_SEED_TIMEOUT_S", "300"))
+startup_state = {
+    "catalog": False, "lexical_index": False, "rag": False, "intent_router": False,
+    "product_index": False, "llm": False, "small_llm": False, "errors": {},
+}
+
+# How long a page / catalog API request waits for the initial seed before answering 503
+CATALOG_REQUEST_WAIT_S = float(os.getenv("CATALOG_REQUEST_WAIT_S", "5"))
+
+def catalog_loading_response(html=False):
+    """
+    None once the catalog is seeded (waiting up to CATALOG_REQUEST_WAIT_S for it);
+    otherwise a 503 with Retry-After, so a restart looks slow instead of empty.
+    """
+    if product_catalog.wait_ready(CATALOG_REQUEST_WAIT_S):
+        return None
+    if html:
+        resp = Response("The shop is starting up. Please refresh in a moment.", status=503, content_type="text/plain; charset=utf-8")
+    else:
+        resp = jsonify({"error": "The catalog is still loading. Please try again in a moment."})
+        resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+def wait_for_catalog():
+    if not product_catalog.wait_ready(CATALOG_SEED_TIMEOUT_S):
+        raise RuntimeError(f"catalog not seeded within {CATALOG_SEED_TIMEOUT_S:.0f}s")
 
-# Build the product index at startup
-try:
-    products_list = fetch_all_products()
-    product_coll = chatbot_logic.build_product_index_if_missing(products_list, force_rebuild=True)
-    print(f"✅ Product semantic index ready. Items indexed: {product_coll.count() if product_coll else 0}")
-except Exception as e:
-    print(f"❌ Failed to build product index at startup: {e}")
+def build_lexical_index():
+    """Full BM25 build from the seeded catalog; later changes arrive through the subscriber."""
+    version = -1
+    while catalog_version() != version:
+        # Rebuild again if the catalog changed while the previous build was running
+        version = catalog_version()
+        lexical_index.rebuild(fetch_all_products())
+    print(f"✅ Lexical index ready: {lexical_index.stats()}")
+
+def load_rag():
+    global rag_collection
+    print("🔧 Building/Loading RAG…")
+    rag_collection = chatbot_logic.build_rag_if_missing()
+
+def prepare_product_index():
+    """
+    Reuse the persisted product index if the catalog fingerprint still matches,
+    otherwise apply only the differences. Changes that arrive while this runs are
+    caught up before returning (the subscriber ignores them until product_coll is set).
+    """
+    global product_coll
+    if not product_catalog.ready:
+        # Syncing against an empty catalog would delete the whole index
+        raise RuntimeError("catalog is not loaded")
+    version = catalog_version()
+    coll, stats = chatbot_logic.sync_product_index(fetch_all_products())
+    product_coll = coll
+    while catalog_version() != version:
+        version = catalog_version()
+        coll, _ = chatbot_logic.sync_product_index(fetch_all_products())
+    print(f"✅ Product semantic index ready ({coll.count()} items): {stats}")
+
+def load_inference_pool():
+    global llm_replicas, inference_pool
+    print("🧠 Loading LLM…")
+    replicas = [chatbot_logic.load_llm() for _ in range(LLM_WORKERS)]
+    for replica in replicas:
+        # Evaluate the shared system prompt once per replica; requests resume from its KV state
+        chatbot_logic.warm_prompt_prefix(replica)
+    llm_replicas = replicas
+    inference_pool = InferencePool(replicas, max_queue=LLM_QUEUE_SIZE, default_timeout=LLM_TIMEOUT_S)
+    print(f"✅ Models loaded ({len(replicas)} LLM worker(s), queue size {LLM_QUEUE_SIZE})")
+
+def load_small_inference_pool():
+    """Optional fallback model for the SMALL_MODEL degradation level."""
+    global small_inference_pool
+    if not chatbot_logic.SMALL_LLM_PATH:
+        return
+    print("🧠 Loading small fallback LLM…")
+    small = chatbot_logic.load_llm(model_path=chatbot_logic.SMALL_LLM_PATH)
+    chatbot_logic.warm_prompt_prefix(small)
+    small_inference_pool = InferencePool([small], max_queue=LLM_QUEUE_SIZE, default_timeout=LLM_TIMEOUT_S)
+    degradation_policy.unavailable.discard(degradation.SMALL_MODEL)
+    print(f"✅ Small fallback LLM loaded from {chatbot_logic.SMALL_LLM_PATH}")
+
+def warm_up():
+    """Load indexes and models off the import path so Flask serves pages immediately."""
+    steps = [
+        ("catalog", wait_for_catalog),
+        ("lexical_index", build_lexical_index),
+        ("rag", load_rag),
+        ("intent_router", lambda: intent_router and intent_router.warm()),
+        ("product_index", prepare_product_index),
+        ("llm", load_inference_pool),
+        ("small_llm", load_small_inference_pool),
+    ]
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            step()
+            startup_state[name] = True
+            print(f"⏱️  Startup step {name} done in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            startup_state["errors"][name] = str(e)
+            print(f"❌ Startup step {name} failed: {e}")
+
+threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.route("/api/ready")
+def api_ready():
+    """Readiness probe: 200 once chat can be served, 503 (with per-component state) before that."""
+    ready = inference_pool is not None
+    return jsonify({"ready": ready, **startup_state}), 200 if ready else 503
 
 # ------------------ Root Route Redirect ------------------
 @app.route("/")
@@ -175,34 +494,31 @@ def home():
         flash("Please log in first")
         return redirect(url_for("login"))
     
-    try:
-        products_ref = db.collection('products')
-        docs = products_ref.stream()
-        
-        all_products = []
-        for doc in docs:
-            product_data = doc.to_dict()
-            product_data['id'] = doc.id
-            all_products.append(product_data)
-            
-    except Exception as e:
-        print(f"Error fetching products from Firestore: {e}")
-        all_products = []
-
-    all_unique_categories = sorted(list(set(p.get('category') for p in all_products if p.get('category'))))
+    loading = catalog_loading_response(html=True)
+    if loading is not None:
+        return loading
+    
+    all_unique_categories = product_catalog.categories()
     current_category = request.args.get('category', 'all')
     
-    if current_category != 'all':
-        products_to_display = [
-            p for p in all_products if p.get('category') == current_category
-        ]
-    else:
-        products_to_display = all_products
+    try:
+        page_args = read_page_args()
+        products_to_display, next_cursor = product_catalog.page(
+            category=None if current_category == 'all' else current_category, **page_args
+        )
+    except ValueError:
+        page_args = {"sort": "name", "descending": False}
+        products_to_display, next_cursor = product_catalog.page(
+            category=None if current_category == 'all' else current_category
+        )
         
     return render_template(
         "home.html",
         username=session.get('user'),
         products=products_to_display,
+        next_cursor=next_cursor,
+        sort=page_args["sort"],
+        order="desc" if page_args["descending"] else "asc",
         current_category=current_category, 
         all_categories=all_unique_categories,
         is_admin=is_admin(session.get('user'))
@@ -289,6 +605,39 @@ def admin():
     
     return render_template("admin.html", username=session.get("user"))
 
+# ------------------ Helper: Background product image upload ------------------
+def patch_product_image(product_id, upload_id, fields):
+    """
+    Apply a finished upload to the product, unless a newer image change superseded it.
+    The upload id check and the write happen in one transaction, so an admin edit
+    that lands while the upload is in flight is never overwritten.
+    """
+    doc_ref = db.collection("products").document(product_id)
+    transaction = db.transaction()
+    
+    @firestore.transactional
+    def _patch(transaction):
+        snap = doc_ref.get(transaction=transaction)
+        current = (snap.to_dict() or {}) if snap.exists else None
+        if current is None or current.get("image_upload_id") != upload_id:
+            return None
+        transaction.update(doc_ref, fields)
+        return current
+    
+    current = _patch(transaction)
+    if current is None:
+        print(f"Skipping stale image upload for product {product_id}")
+        return
+    product_catalog.put(product_id, {**current, **fields})
+
+def queue_product_image(product_id, upload_id, file):
+    """Upload `file` off the request thread; the product is patched when it finishes."""
+    image_uploads.enqueue(
+        file,
+        on_done=lambda result: patch_product_image(product_id, upload_id, {**result, "image_status": "ready"}),
+        on_error=lambda e: patch_product_image(product_id, upload_id, {"image_status": "failed"}),
+    )
+
 # ------------------ API: Add Product ------------------
 @app.route("/api/products/add", methods=["POST"])
 def api_add_product():
@@ -311,13 +660,14 @@ def api_add_product():
             return jsonify({"error": "Invalid price value"}), 400
 
         image_url = ""
+        image_status = "ready"
+        upload_id = ""
         file = request.files.get("file")
         
         if file and file.filename:
-            image_url = upload_file_to_cloudinary(file)
-            
-            if not image_url:
-                return jsonify({"error": "Image upload failed via Cloudinary. Check server logs."}), 500
+            # Saved right away in a "pending" image state; the upload runs in the background
+            image_status = "pending"
+            upload_id = uuid.uuid4().hex
         
         elif request.form.get("imageUrl"):
             image_url = request.form.get("imageUrl")
@@ -330,21 +680,26 @@ def api_add_product():
             "price": price,
             "category": category,
             "description": description,
-            "image": image_url
+            "image": image_url,
+            "image_status": image_status,
+            "image_upload_id": upload_id,
+            "created_at": firestore.SERVER_TIMESTAMP
         }
         
         doc_ref = db.collection("products").add(product_data)
 
-        # Rebuild product index after adding new product (force rebuild)
-        global product_coll
-        products_list = fetch_all_products()
-        product_coll = chatbot_logic.build_product_index_if_missing(products_list, force_rebuild=True)
-
         # doc_ref may be (DocumentReference, write_time) depending on SDK — use [0].id if tuple
         product_id = doc_ref[0].id if isinstance(doc_ref, (list, tuple)) else getattr(doc_ref, "id", None)
+        if product_id:
+            # Local stand-in for the server timestamp until the listener delivers the real one
+            product_catalog.put(product_id, {**product_data, "created_at": datetime.now(timezone.utc)})
+            if upload_id:
+                queue_product_image(product_id, upload_id, file)
+
         return jsonify({
             "message": "Product added successfully",
-            "product_id": product_id
+            "product_id": product_id,
+            "image_status": image_status
         }), 201
         
     except Exception as e:
@@ -359,12 +714,13 @@ def api_get_single_product(product_id):
         return jsonify({"error": "Not authenticated"}), 401
     
     try:
-        doc = db.collection('products').document(product_id).get()
-        if not doc.exists:
-            return jsonify({"error": "Product not found"}), 404
-            
-        product_data = doc.to_dict()
-        product_data['id'] = doc.id
+        product_data = product_catalog.get(product_id)
+        if product_data is None:
+            doc = db.collection('products').document(product_id).get()
+            if not doc.exists:
+                return jsonify({"error": "Product not found"}), 404
+            product_data = doc.to_dict()
+            product_data['id'] = doc.id
         
         return jsonify(product_data), 200
         
@@ -399,19 +755,22 @@ def api_update_product(product_id):
         except (TypeError, ValueError):
             return jsonify({"error": "Invalid price value"}), 400
         
+        image_fields = {}
+        file = None
         if image_option == 'upload':
             file = request.files.get("file") 
             if file and file.filename:
-                new_image_url = upload_file_to_cloudinary(file)
-                if new_image_url:
-                    image_url = new_image_url
-                else:
-                    return jsonify({"error": "New image upload failed."}), 500
+                # Keep showing the current image until the new upload finishes
+                image_fields = {"image_status": "pending", "image_upload_id": uuid.uuid4().hex}
+            else:
+                file = None
 
         elif image_option == 'url':
             new_image_url_input = request.form.get("imageUrl")
             if new_image_url_input and new_image_url_input.strip():
                 image_url = new_image_url_input.strip()
+                # A direct URL supersedes any upload still in flight
+                image_fields = {"image_status": "ready", "image_upload_id": "", "image_variants": {}}
             else:
                 return jsonify({"error": "Image URL is required when URL option is selected"}), 400
 
@@ -420,19 +779,19 @@ def api_update_product(product_id):
             "price": price,
             "category": category,
             "description": description,
-            "image": image_url
+            "image": image_url,
+            **image_fields
         }
         
         doc_ref.update(product_data)
-        
-        # Rebuild product index after updating product
-        global product_coll
-        products_list = fetch_all_products()
-        product_coll = chatbot_logic.build_product_index_if_missing(products_list, force_rebuild=True)
+        product_catalog.put(product_id, {**existing_data, **product_data})
+        if file is not None:
+            queue_product_image(product_id, image_fields["image_upload_id"], file)
         
         return jsonify({
             "message": "Product updated successfully",
-            "product_id": product_id
+            "product_id": product_id,
+            "image_status": product_data.get("image_status", existing_data.get("image_status", "ready"))
         }), 200
         
     except Exception as e:
@@ -449,17 +808,22 @@ def api_get_all_products():
     if not is_admin(session.get("user")):
         return jsonify({"error": "Admin privileges required"}), 403
     
+    loading = catalog_loading_response()
+    if loading is not None:
+        return loading
+    
     try:
-        products_ref = db.collection("products")
-        docs = products_ref.stream()
-        
-        products = []
-        for doc in docs:
-            product = doc.to_dict()
-            product["id"] = doc.id
-            products.append(product)
-        
-        return jsonify({"products": products})
+        try:
+            page_args = read_page_args(default_limit=50)
+            products, next_cursor = product_catalog.page(**page_args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            "products": products,
+            "next_cursor": next_cursor,
+            "total": len(product_catalog),
+            "catalog_version": catalog_version()
+        })
     except Exception as e:
         print(f"Error fetching products: {e}")
         return jsonify({"error": "Failed to fetch products"}), 500
@@ -476,17 +840,115 @@ def api_delete_product(product_id):
     
     try:
         db.collection("products").document(product_id).delete()
-        
-        # Rebuild product index after deleting product
-        global product_coll
-        products_list = fetch_all_products()
-        product_coll = chatbot_logic.build_product_index_if_missing(products_list)
+        product_catalog.remove(product_id)
         
         return jsonify({"message": "Product deleted successfully"})
     except Exception as e:
         print(f"Error deleting product: {e}")
         return jsonify({"error": "Failed to delete product"}), 500
 
+# ------------------ API: RAG document ingestion (admin) ------------------
+rag_ingest_state = {"running": False, "last": None, "error": None}
+rag_ingest_lock = threading.Lock()
+
+def run_rag_ingest():
+    global rag_collection
+    try:
+        rag_collection, stats = chatbot_logic.ingest_rag_docs()
+        rag_ingest_state.update(last=stats, error=None)
+        print(f"📚 RAG docs ingested: {stats}")
+    except Exception as e:
+        rag_ingest_state["error"] = str(e)
+        print(f"❌ RAG ingestion failed: {e}")
+    finally:
+        rag_ingest_state["running"] = False
+
+@app.route("/api/admin/rag/ingest", methods=["GET", "POST"])
+def api_rag_ingest():
+    """
+    POST: re-ingest new/changed/deleted files under rag/docs in the background
+    (chat keeps using the index meanwhile). GET: status of the last run - ADMIN ONLY
+    """
+    if "user" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    if not is_admin(session.get("user")):
+        return jsonify({"error": "Admin privileges required"}), 403
+    
+    if request.method == "POST":
+        with rag_ingest_lock:
+            started = not rag_ingest_state["running"]
+            rag_ingest_state["running"] = True
+        if started:
+            threading.Thread(target=run_rag_ingest, name="rag-ingest", daemon=True).start()
+            return jsonify(rag_ingest_state), 202
+    return jsonify(rag_ingest_state)
+
+# ------------------ API: Product index re-sync (admin) ------------------
+product_reindex_state = {"running": False, "last": None, "error": None}
+product_reindex_lock = threading.Lock()
+
+def run_product_reindex():
+    try:
+        coll, stats = chatbot_logic.sync_product_index(fetch_all_products())
+        product_reindex_state.update(last=stats, error=None)
+        print(f"🔎 Product index re-synced ({coll.count()} items): {stats}")
+    except Exception as e:
+        product_reindex_state["error"] = str(e)
+        print(f"❌ Product index re-sync failed: {e}")
+    finally:
+        product_reindex_state["running"] = False
+
+@app.route("/api/admin/products/reindex", methods=["GET", "POST"])
+def api_product_reindex():
+    """
+    POST: bring the product semantic index in line with the cached catalog in the
+    background (this process owns the index). GET: status of the last run - ADMIN ONLY
+    """
+    if "user" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    if not is_admin(session.get("user")):
+        return jsonify({"error": "Admin privileges required"}), 403
+    
+    if request.method == "POST":
+        if not startup_state["product_index"]:
+            return jsonify({"error": "Product index is still loading"}), 503
+        with product_reindex_lock:
+            started = not product_reindex_state["running"]
+            product_reindex_state["running"] = True
+        if started:
+            threading.Thread(target=run_product_reindex, name="product-reindex", daemon=True).start()
+            return jsonify(product_reindex_state), 202
+    return jsonify(product_reindex_state)
+
+# ------------------ API: Product Search (JSON) ------------------
+@app.route("/api/products/search")
+def api_search_products():
+    """Search-as-you-type over the whole catalog (BM25 index), exact name / SKU matches first"""
+    if "user" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 8)), 1), 50)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not query:
+        return jsonify({"products": [], "query": query})
+    loading = catalog_loading_response()
+    if loading is not None:
+        return loading
+    
+    ids = lexical_index.exact(query)
+    seen = set(ids)
+    for pid, _ in lexical_index.search(query, k=limit + len(ids), prefix=True):
+        if pid not in seen:
+            seen.add(pid)
+            ids.append(pid)
+    products = [p for p in (product_catalog.get(pid) for pid in ids[:limit]) if p is not None]
+    return jsonify({"products": products, "query": query, "ready": startup_state["lexical_index"]})
+
 # ------------------ API: Fetch Products (JSON) ------------------
 @app.route("/api/products")
 def api_products():
@@ -494,27 +956,30 @@ def api_products():
     if "user" not in session:
         return jsonify({"error": "Not authenticated"}), 401
     
+    loading = catalog_loading_response()
+    if loading is not None:
+        return loading
+    
     try:
         category = request.args.get('category', 'all')
         
-        products_ref = db.collection('products')
-        docs = products_ref.stream()
-        
-        all_products = []
-        for doc in docs:
-            product_data = doc.to_dict()
-            product_data['id'] = doc.id
-            all_products.append(product_data)
-        
-        if category != 'all':
-            all_products = [p for p in all_products if p.get('category') == category]
+        try:
+            page_args = read_page_args()
+            page, next_cursor = product_catalog.page(
+                category=None if category == 'all' else category, **page_args
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        all_categories = sorted(list(set(p.get('category') for p in all_products if p.get('category'))))
+        category_counts = product_catalog.category_counts()
         
         return jsonify({
-            "products": all_products,
-            "categories": all_categories,
-            "current_category": category
+            "products": page,
+            "next_cursor": next_cursor,
+            "categories": sorted(category_counts),
+            "category_counts": category_counts,
+            "current_category": category,
+            "catalog_version": catalog_version()
         })
     except Exception as e:
         print(f"Error in /api/products: {e}")
@@ -537,11 +1002,214 @@ def test():
 # CHATBOT API
 # ==========================================================
 
+def chat_cache_scope():
+    """Cached replies are only valid for the catalog + RAG index they were generated from."""
+    return (catalog_version(), chatbot_logic.rag_index_version())
+
+def format_price(price):
+    value = query_filters.price_value(price)
+    return f"RM{value:.2f}" if value is not None else f"RM{price}"
+
+def product_list_reply(matches):
+    """Templated answer for a product lookup, built directly from the ranked matches."""
+    lines = ["Here's what I found in our catalog:", ""]
+    for r in matches:
+        meta = r.get("meta", {})
+        category = f" ({meta['category']})" if meta.get("category") else ""
+        lines.append(f"• {meta.get('name', 'Unknown')} — {format_price(meta.get('price', ''))}{category}")
+    lines += ["", "Let me know if you'd like more details on any of these!"]
+    return "\n".join(lines)
+
+def timed_stage(stage, fn, *args, **kwargs):
+    with CHAT_STAGE.time(stage=stage):
+        return fn(*args, **kwargs)
+
+def start_retrieval(user_message, query_embedding=None, include_rag=True):
+    """
+    Submit product and RAG retrieval to the shared stage pool at the same time, so
+    pre-LLM latency is the slower of the two rather than their sum.
+    Returns {stage: (future, deadline)}; read results with stage_result().
+    """
+    if query_embedding is None:
+        with CHAT_STAGE.time(stage="embed"):
+            query_embedding = embed_batcher(user_message)
+    now = time.perf_counter()
+    retrieval = {
+        "products": (
+            chat_stage_pool.submit(find_product_matches, user_message, query_embedding=query_embedding),
+            now + STAGE_DEADLINES_S["products"],
+        ),
+    }
+    if include_rag:
+        retrieval["rag"] = (
+            chat_stage_pool.submit(timed_stage, "rag_retrieval", rag_batcher, query_embedding),
+            now + STAGE_DEADLINES_S["rag"],
+        )
+    return retrieval
+
+def stage_result(retrieval, stage, usage, default):
+    """
+    Result of a retrieval stage, waiting at most until its deadline. A late or
+    failed stage is dropped (default returned) and listed in usage["degraded"].
+    """
+    future, deadline = retrieval[stage]
+    try:
+        return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+    except StageTimeout:
+        reason = "deadline"
+    except Exception as e:
+        print(f"⚠️ Chat stage {stage} failed: {e}")
+        reason = "error"
+    degraded = usage.setdefault("degraded", [])
+    if stage not in degraded:
+        degraded.append(stage)
+        STAGE_DEGRADED.inc(stage=stage, reason=reason)
+    return default
+
+def answer_lookup(user_message, usage, retrieval, query_embedding=None):
+    """
+    Route the turn by intent. For a product lookup with matches, return the
+    templated reply and skip generation; otherwise None. Retrieval keeps running
+    meanwhile, so open questions lose no time to routing.
+    """
+    if intent_router is None:
+        return None
+    with CHAT_STAGE.time(stage="intent"):
+        intent, _ = intent_router.classify(user_message, vector=query_embedding)
+    usage["intent"] = intent
+    if intent != PRODUCT_LOOKUP:
+        return None
+    matches = stage_result(retrieval, "products", usage, [])
+    if not matches:
+        # Nothing to list: let the LLM answer (it can say so politely)
+        return None
+    usage["llm"] = False
+    CHAT_INTENT.inc(intent=intent, llm="false")
+    return product_list_reply(matches)
+
+def exact_lookup_reply(user_message, usage):
+    """
+    A message that is exactly a product name / SKU is a lookup by definition: reply
+    with the templated list before the cache lookup and intent routing embed the
+    query. None for any other message.
+    """
+    with CHAT_STAGE.time(stage="lexical_search"):
+        matches = exact_product_matches(user_message)
+    if not matches:
+        return None
+    usage.update(intent=PRODUCT_LOOKUP, llm=False)
+    CHAT_INTENT.inc(intent=PRODUCT_LOOKUP, llm="false")
+    return product_list_reply(matches)
+
+def gather_chat_context(retrieval, usage):
+    """Ranked product context lines + RAG chunks for the LLM; a stage past its deadline is left out."""
+    with CHAT_STAGE.time(stage="retrieval_wait"):
+        product_lines = product_context_lines(stage_result(retrieval, "products", usage, []))
+        rag_chunks = stage_result(retrieval, "rag", usage, []) if "rag" in retrieval else []
+    return product_lines, rag_chunks
+
+def record_generation(usage, seconds):
+    """Generation span + token counters; adds tokens_per_sec and decode_tokens_per_sec to `usage`."""
+    CHAT_STAGE.observe(seconds, stage="generation")
+    LLM_PROMPT_TOKENS.inc(usage.get("prompt_tokens") or 0)
+    completion = usage.get("completion_tokens") or 0
+    LLM_COMPLETION_TOKENS.inc(completion)
+    if completion and seconds > 0:
+        usage["tokens_per_sec"] = round(completion / seconds, 2)
+        LLM_TOKENS_PER_SEC.observe(completion / seconds)
+    # Decode speed from the first token on: prompt evaluation would make short
+    # replies (and the shorter SHORT_REPLIES budget) look slow
+    first_token_at = usage.pop("first_token_at", None)
+    if first_token_at is not None and completion > 1:
+        decode_s = time.perf_counter() - first_token_at
+        if decode_s > 0:
+            usage["decode_tokens_per_sec"] = round((completion - 1) / decode_s, 2)
+            if usage.get("model") == "main":
+                # The degradation policy tracks the main model's speed only
+                degradation_policy.observe_tokens_per_sec((completion - 1) / decode_s)
+
+def timed_generation(pieces, usage):
+    """Wrap a chat_stream generator so its generation time is recorded when it ends."""
+    t0 = time.perf_counter()
+    try:
+        yield from pieces
+    finally:
+        record_generation(usage, time.perf_counter() - t0)
+
+def degradation_level(usage):
+    """Pick this turn's degradation level from the inference queue; recorded in usage."""
+    s = inference_pool.stats()
+    level = degradation_policy.evaluate(s["queue_depth"], s["max_queue"])
+    usage["degradation_level"] = level
+    usage["degradation"] = LEVEL_NAMES[level]
+    DEGRADATION_REPLIES.inc(level=LEVEL_NAMES[level])
+    return level
+
+def generation_settings(level):
+    """(inference pool, max_tokens, model label) for a degradation level below TEMPLATED_ONLY."""
+    max_tokens = DEFAULT_MAX_TOKENS if level == degradation.NORMAL else SHORT_REPLY_MAX_TOKENS
+    if level == degradation.SMALL_MODEL and small_inference_pool is not None:
+        return small_inference_pool, max_tokens, "small"
+    return inference_pool, max_tokens, "main"
+
+def overload_reply(retrieval, usage):
+    """TEMPLATED_ONLY level: the product list if there is one, else PoolBusy (503)."""
+    matches = stage_result(retrieval, "products", usage, [])
+    if not matches:
+        raise PoolBusy("overloaded: templated-only mode and no product matches")
+    usage["llm"] = False
+    return product_list_reply(matches)
+
+def cacheable(usage):
+    """Only full-quality answers go into the response cache."""
+    return not usage.get("degraded") and usage.get("degradation_level", degradation.NORMAL) == degradation.NORMAL
+
+def reply_job(user_message, product_lines, rag_chunks, usage, stream=False, max_tokens=DEFAULT_MAX_TOKENS, model="main"):
+    """
+    Inference-pool job: fit the context into the token budget with the worker's own
+    tokenizer, then generate. `usage` is filled with context/prompt token counts.
+    """
+    queued_at = time.perf_counter()
+    usage["model"] = model
+    
+    def job(llm):
+        CHAT_STAGE.observe(time.perf_counter() - queued_at, stage="queue_wait")
+        with CHAT_STAGE.time(stage="context_assembly"):
+            context, stats = chatbot_logic.assemble_context(
+                llm, product_lines, rag_chunks, user_text=user_message, max_tokens=max_tokens
+            )
+        usage.update(stats)
+        if stream:
+            return timed_generation(
+                chatbot_logic.chat_stream(llm, user_message, context, usage=usage, max_tokens=max_tokens), usage
+            )
+        t0 = time.perf_counter()
+        reply = chatbot_logic.chat(llm, user_message, context, usage=usage, max_tokens=max_tokens)
+        record_generation(usage, time.perf_counter() - t0)
+        return reply
+    return job
+
+def observe_chat(endpoint, outcome, started):
+    CHAT_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    CHAT_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+
+def cached_reply_lookup(user_message, scope):
+    with CHAT_STAGE.time(stage="cache_lookup"):
+        return response_cache.lookup(user_message, scope)
+
+def record_history(username, role, text):
+    with CHAT_STAGE.time(stage="history_write"):
+        history_writer.record(username, role, text)
+
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
     if "user" not in session:
         return jsonify({"error": "User not logged in"}), 401
     
+    if inference_pool is None:
+        return warming_up_response()
+    
+    started = time.perf_counter()
     try:
         data = request.get_json()
         user_message = data.get("message", "").strip()
@@ -549,39 +1217,215 @@ def api_chat():
         if not user_message:
             return jsonify({"error": "Empty message"}), 400
         
-        # 1. Save user's message to history
-        chat_ref = db.collection("users").document(session["user"]).collection("chat_history")
-        chat_ref.add({
-            "role": "user",
-            "text": user_message,
-            "created_at": firestore.SERVER_TIMESTAMP
-        })
+        # 1. Save user's message to history (buffered, written in the background)
+        username = session["user"]
+        record_history(username, "user", user_message)
         
-        # 2. Get Product Recommendations (using chromadb semantic search)
-        product_context = get_product_recommendations(user_message)
+        # 2. How loaded are we? Decides reply length, RAG, model and whether to generate at all
+        #    (recorded in usage for every reply, cache hits included)
+        usage = {}
+        level = degradation_level(usage)
         
-        # 3. Get RAG info (general knowledge)
-        rag_context = chatbot_logic.rag_query(rag_collection, user_message)
+        # 3. Exactly a product name / SKU? Answer from the lexical index, nothing embedded
+        bot_reply = exact_lookup_reply(user_message, usage)
+        outcome = "ok"
         
-        # 4. Combine context for the LLM
-        full_context = f"Product Catalog Context:\n{product_context}\n\nOther Info Context:\n{rag_context}"
+        # Near-duplicate question? Skip retrieval and generation entirely
+        if bot_reply is None:
+            scope = chat_cache_scope()
+            bot_reply, query_vec = cached_reply_lookup(user_message, scope)
+            outcome = "cache_hit"
         
-        # 5. Get LLM reply
-        bot_reply = chatbot_logic.chat(llm_model, user_message, full_context)
+        if bot_reply is None:
+            outcome = "ok"
+            # 4. Product + RAG retrieval start concurrently (each with its own deadline)
+            retrieval = start_retrieval(user_message, query_embedding=query_vec, include_rag=level < degradation.NO_RAG)
+            
+            # 5. Plain product lookup? Answer with the matching products, no generation
+            bot_reply = answer_lookup(user_message, usage, retrieval, query_embedding=query_vec)
+            if bot_reply is None and level >= degradation.TEMPLATED_ONLY:
+                bot_reply = overload_reply(retrieval, usage)
+            
+            if bot_reply is None:
+                # Product recommendations + RAG info for the LLM context
+                product_lines, rag_chunks = gather_chat_context(retrieval, usage)
+                
+                # 6. Get LLM reply (queued on the inference pool; context fitted to the token budget)
+                pool, max_tokens, model = generation_settings(level)
+                bot_reply = pool.run(reply_job(user_message, product_lines, rag_chunks, usage, max_tokens=max_tokens, model=model))
+                CHAT_INTENT.inc(intent=usage.get("intent", "unrouted"), llm="true")
+                print(f"🧾 /api/chat tokens: {usage}")
+            if cacheable(usage):
+                # Don't pin an answer built from partial context or under load
+                response_cache.store(user_message, bot_reply, scope, vector=query_vec)
         
-        # 6. Save bot's reply to history
-        chat_ref.add({
-            "role": "assistant",
-            "text": bot_reply,
-            "created_at": firestore.SERVER_TIMESTAMP
-        })
+        # 7. Save bot's reply to history
+        record_history(username, "assistant", bot_reply)
         
-        # 7. Return reply to the front-end
-        return jsonify({"response": bot_reply})
+        # 8. Return reply to the front-end
+        observe_chat("chat", outcome, started)
+        return jsonify({"response": bot_reply, "usage": usage})
         
+    except PoolBusy:
+        observe_chat("chat", "busy", started)
+        return busy_response()
+    except InferenceTimeout as e:
+        print(f"Timeout in /api/chat: {e}")
+        observe_chat("chat", "timeout", started)
+        return jsonify({"error": "The assistant took too long to answer. Please try again."}), 504
     except Exception as e:
         print(f"Error in /api/chat: {e}")
+        observe_chat("chat", "error", started)
+        return jsonify({"error": "An internal error occurred"}), 500
+
+def warming_up_response():
+    """503 while the models are still loading in the background (see /api/ready)."""
+    resp = jsonify({"error": "The assistant is starting up. Please try again in a moment."})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "10"
+    return resp
+
+def busy_response():
+    """503 with a Retry-After hint when the inference queue is full."""
+    resp = jsonify({"error": "The assistant is busy right now. Please try again shortly."})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(inference_pool.retry_after())
+    return resp
+
+def sse_event(payload, event=None):
+    """Format one Server-Sent Events message."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(payload)}\n\n"
+
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """
+    Streaming variant of /api/chat. Sends tokens as Server-Sent Events:
+      data: {"token": "..."}                 (one per generated piece)
+      event: done / data: {"response": ...}  (full reply, after history is saved)
+      event: error / data: {"error": ...}
+    """
+    if "user" not in session:
+        return jsonify({"error": "User not logged in"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    user_message = data.get("message", "").strip()
+    if not user_message:
+        return jsonify({"error": "Empty message"}), 400
+    
+    if inference_pool is None:
+        return warming_up_response()
+    
+    started = time.perf_counter()
+    username = session["user"]
+    
+    def sse_reply(reply, usage, outcome):
+        """A reply that needed no generation, sent as a one-token stream."""
+        def send():
+            record_history(username, "assistant", reply)
+            yield sse_event({"token": reply})
+            yield sse_event({"response": reply, "usage": usage}, event="done")
+            observe_chat("chat_stream", outcome, started)
+        return Response(send(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
+    # Everything that needs no LLM runs before the stream opens (same order as
+    # /api/chat), so a full queue only rejects turns that would actually queue a job
+    try:
+        record_history(username, "user", user_message)
+        
+        usage = {}
+        level = degradation_level(usage)
+        exact_reply = exact_lookup_reply(user_message, usage)
+        if exact_reply is not None:
+            return sse_reply(exact_reply, usage, "ok")
+        
+        scope = chat_cache_scope()
+        cached_reply, query_vec = cached_reply_lookup(user_message, scope)
+        if cached_reply is not None:
+            return sse_reply(cached_reply, usage, "cache_hit")
+        
+        retrieval = start_retrieval(user_message, query_embedding=query_vec, include_rag=level < degradation.NO_RAG)
+        templated = answer_lookup(user_message, usage, retrieval, query_embedding=query_vec)
+        if templated is None and level >= degradation.TEMPLATED_ONLY:
+            templated = overload_reply(retrieval, usage)
+        if templated is not None:
+            if cacheable(usage):
+                response_cache.store(user_message, templated, scope, vector=query_vec)
+            return sse_reply(templated, usage, "ok")
+        
+        pool, max_tokens, model = generation_settings(level)
+        # Fail fast before opening the stream; once headers are sent we can't 503
+        if pool.is_full():
+            raise PoolBusy("inference queue full")
+    except PoolBusy:
+        observe_chat("chat_stream", "busy", started)
+        return busy_response()
+    except Exception as e:
+        print(f"Error in /api/chat/stream: {e}")
+        observe_chat("chat_stream", "error", started)
         return jsonify({"error": "An internal error occurred"}), 500
+    
+    def generate():
+        pieces = []
+        try:
+            product_lines, rag_chunks = gather_chat_context(retrieval, usage)
+            
+            job = reply_job(user_message, product_lines, rag_chunks, usage, stream=True, max_tokens=max_tokens, model=model)
+            for piece in pool.stream(job):
+                pieces.append(piece)
+                yield sse_event({"token": piece})
+            
+            bot_reply = "".join(pieces).strip()
+            CHAT_INTENT.inc(intent=usage.get("intent", "unrouted"), llm="true")
+            print(f"🧾 /api/chat/stream tokens: {usage}")
+            if cacheable(usage):
+                response_cache.store(user_message, bot_reply, scope, vector=query_vec)
+            
+            # Persist the reply once the stream has finished
+            record_history(username, "assistant", bot_reply)
+            yield sse_event({"response": bot_reply, "usage": usage}, event="done")
+            observe_chat("chat_stream", "ok", started)
+        except PoolBusy:
+            observe_chat("chat_stream", "busy", started)
+            yield sse_event({"error": "The assistant is busy right now. Please try again shortly."}, event="error")
+        except InferenceTimeout as e:
+            print(f"Timeout in /api/chat/stream: {e}")
+            observe_chat("chat_stream", "timeout", started)
+            yield sse_event({"error": "The assistant took too long to answer. Please try again."}, event="error")
+        except Exception as e:
+            print(f"Error in /api/chat/stream: {e}")
+            observe_chat("chat_stream", "error", started)
+            yield sse_event({"error": "An internal error occurred"}, event="error")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/inference/stats")
+def api_inference_stats():
+    """Queue depth, wait/run times and counters of the LLM inference pool, plus cache and history writer stats."""
+    if inference_pool is None:
+        return jsonify({"ready": False, **startup_state}), 503
+    stats = inference_pool.stats()
+    stats["response_cache"] = response_cache.stats()
+    stats["chat_history"] = history_writer.stats()
+    stats["product_index_sync"] = product_index_sync.stats()
+    stats["retrieval_batching"] = {
+        "embed": embed_batcher.stats(),
+        "rag": rag_batcher.stats(),
+        "products": product_query_batcher.stats(),
+    }
+    stats["intents"] = intent_router.stats() if intent_router else None
+    stats["degradation"] = degradation_policy.stats()
+    stats["small_model_pool"] = small_inference_pool.stats() if small_inference_pool else None
+    return jsonify(stats)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage latency histograms, token counters, index and cache sizes."""
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
 
 # ------------------ Run App ------------------
 if __name__ == "__main__":
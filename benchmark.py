@@ -0,0 +1,265 @@
+"""
+Offline micro-benchmarks for chatbot_logic hot paths.
+
+Runs without Firestore or the Flask app: builds synthetic catalogs and a synthetic
+RAG corpus in a throwaway Chroma directory and times
+  - product index build (build_product_index_if_missing) and startup reuse (sync_product_index)
+  - product_index_query latency, filtered vs unfiltered
+  - rag_query latency
+  - prompt assembly (assemble_context + prompt tokens)
+  - optionally chat() generation against a (tiny) local GGUF
+
+Results are written as JSON so runs can be compared across versions, e.g.
+    python benchmark.py --sizes 1000,10000 --out bench_results/$(git rev-parse --short HEAD).json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import chatbot_logic
+
+WORDS = (
+    "wireless bluetooth cotton leather organic stainless yoga running waterproof compact "
+    "portable ergonomic smart herbal vitamin noise cancelling charging lightweight durable "
+    "eco friendly adjustable premium classic vintage ceramic bamboo travel kitchen outdoor"
+).split()
+NOUNS = "earbuds watch speaker jacket shoes wallet shirt noodles tea lamp pillow pan serum shampoo mat bottle backpack".split()
+CATEGORIES = ["Electronics", "Fashion", "Groceries & Food", "Home & Living", "Health & Beauty", "Sports & Outdoors"]
+
+
+# ---------- Synthetic data ----------
+def synthetic_products(n, seed=0):
+    rng = random.Random(seed)
+    for i in range(n):
+        name = " ".join(rng.sample(WORDS, 2) + [rng.choice(NOUNS)]).title()
+        yield {
+            "id": f"p{i:07d}",
+            "name": name,
+            "category": rng.choice(CATEGORIES),
+            "description": " ".join(rng.choices(WORDS + NOUNS, k=rng.randint(8, 20))).capitalize() + ".",
+            "price": round(rng.uniform(2, 300), 2),
+            "image": f"https://example.invalid/{i}.jpg",
+            "gender": rng.choice(["male", "female", "unisex"]),
+        }
+
+def synthetic_rag_chunks(n, seed=1):
+    rng = random.Random(seed)
+    topics = ["shipping", "returns", "refund", "warranty", "payment", "delivery", "membership", "vouchers"]
+    for i in range(n):
+        topic = rng.choice(topics)
+        body = " ".join(rng.choices(WORDS + NOUNS + topics, k=rng.randint(60, 130)))
+        yield f"{topic.title()} policy section {i}. {body}."
+
+def synthetic_queries(n, seed=2):
+    rng = random.Random(seed)
+    templates = ["do you have {a} {n}", "any {n}?", "recommend a {a} {n} for men", "cheap {n} for women", "what is your {t} policy"]
+    topics = ["shipping", "returns", "refund", "warranty"]
+    return [
+        rng.choice(templates).format(a=rng.choice(WORDS), n=rng.choice(NOUNS), t=rng.choice(topics))
+        for _ in range(n)
+    ]
+
+
+# ---------- Timing helpers ----------
+def percentiles(samples_ms):
+    s = sorted(samples_ms)
+    if not s:
+        return {}
+    pick = lambda q: s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+    return {
+        "count": len(s),
+        "mean_ms": sum(s) / len(s),
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": s[-1],
+    }
+
+def time_calls(fn, args_list, warmup=3):
+    for a in args_list[:warmup]:
+        fn(a)
+    samples = []
+    for a in args_list:
+        t0 = time.perf_counter()
+        fn(a)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return percentiles(samples)
+
+
+class WhitespaceTokenizerLLM:
+    """Stand-in for Llama when no GGUF is given: only tokenize() is needed for prompt assembly."""
+
+    def tokenize(self, text, add_bos=True):
+        return text.split() + ([] if not add_bos else [b"<s>"])
+
+
+# ---------- Benchmarks ----------
+def bench_catalog(size, workdir, queries, batch_size):
+    path = os.path.join(workdir, f"catalog_{size}")
+    products = list(synthetic_products(size))
+
+    t0 = time.perf_counter()
+    coll = chatbot_logic.build_product_index_if_missing(products, path=path, force_rebuild=True)
+    build_s = time.perf_counter() - t0
+
+    # Restart path: first sync records the fingerprint, the second one should reuse the index
+    chatbot_logic.sync_product_index(products, path=path)
+    resync_s = _time_once(lambda: chatbot_logic.sync_product_index(products, path=path))
+
+    # Embedding is shared by all query kinds; time it separately from the vector search
+    embeddings = chatbot_logic.embed_queries(queries)
+    pairs = list(zip(queries, embeddings))
+    return {
+        "size": size,
+        "index_build_seconds": build_s,
+        "index_build_docs_per_sec": size / build_s if build_s else None,
+        "index_startup_reuse_seconds": resync_s,
+        "embed_query_latency": time_calls(chatbot_logic.embed_query, queries),
+        "embed_batch_seconds": _time_once(lambda: chatbot_logic.embed_queries(queries[:batch_size])),
+        "query_unfiltered": time_calls(
+            lambda qe: chatbot_logic.product_index_query(coll, qe[0], n_results=6, query_embedding=qe[1]), pairs
+        ),
+        "query_filtered": time_calls(
+            lambda qe: chatbot_logic.product_index_query(coll, qe[0], n_results=6, where={"gender": "male"}, query_embedding=qe[1]), pairs
+        ),
+        "query_filtered_price_range": time_calls(
+            lambda qe: chatbot_logic.product_index_query(
+                coll, qe[0], n_results=6, query_embedding=qe[1],
+                where={"$and": [{"price": {"$lte": 100.0}}, {"category": "Fashion"}]},
+            ), pairs
+        ),
+        "query_text_end_to_end": time_calls(
+            lambda q: chatbot_logic.product_index_query(coll, q, n_results=6), queries
+        ),
+    }
+
+def bench_rag(n_chunks, workdir, queries):
+    client = chatbot_logic.get_chroma_client(os.path.join(workdir, "rag"))
+    coll = client.get_or_create_collection("local_docs", embedding_function=chatbot_logic.get_embedding_function())
+    chunks = list(synthetic_rag_chunks(n_chunks))
+
+    t0 = time.perf_counter()
+    for i in range(0, len(chunks), 1000):
+        batch = chunks[i:i + 1000]
+        coll.add(documents=batch, ids=[f"c{i + j}" for j in range(len(batch))])
+    build_s = time.perf_counter() - t0
+
+    return coll, {
+        "chunks": n_chunks,
+        "index_build_seconds": build_s,
+        "query_latency": time_calls(lambda q: chatbot_logic.rag_query(coll, q), queries),
+    }
+
+def bench_prompt(llm, rag_coll, queries):
+    product_lines = [
+        f"- Name: {p['name']} | Price: RM{p['price']} | Category: {p['category']}"
+        for p in synthetic_products(6)
+    ]
+    chunk_sets = [chatbot_logic.rag_query_chunks(rag_coll, q) for q in queries]
+    stats = []
+
+    def assemble(chunks):
+        context, s = chatbot_logic.assemble_context(llm, product_lines, chunks)
+        stats.append(s["context_tokens"])
+        return chatbot_logic.build_prompt("benchmark question", context)
+
+    return {
+        "assembly_latency": time_calls(assemble, chunk_sets),
+        "context_tokens": percentiles(stats),
+    }
+
+def bench_llm(llm, queries, n):
+    context = "Product Catalog Context:\n- Name: Yoga Mat | Price: RM69.9 | Category: Sports & Outdoors"
+    chatbot_logic.warm_prompt_prefix(llm)
+    samples, tps = [], []
+    for q in queries[:n]:
+        usage = {}
+        t0 = time.perf_counter()
+        chatbot_logic.chat(llm, q, context, usage=usage)
+        elapsed = time.perf_counter() - t0
+        samples.append(elapsed * 1000.0)
+        if usage.get("completion_tokens"):
+            tps.append(usage["completion_tokens"] / elapsed)
+    return {
+        "chat_latency": percentiles(samples),
+        "tokens_per_sec_mean": sum(tps) / len(tps) if tps else None,
+    }
+
+def _time_once(fn):
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=chatbot_logic.BASE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for chatbot_logic.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated catalog sizes")
+    parser.add_argument("--rag-chunks", type=int, default=2000, help="synthetic RAG corpus size")
+    parser.add_argument("--queries", type=int, default=200, help="queries per latency measurement")
+    parser.add_argument("--embed-batch", type=int, default=32, help="batch size for the batched-embedding timing")
+    parser.add_argument("--gguf", help="optional small GGUF model for chat() timing")
+    parser.add_argument("--llm-queries", type=int, default=5, help="chat() calls when --gguf is given")
+    parser.add_argument("--out", default=os.path.join("bench_results", "latest.json"), help="JSON results file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary Chroma directory")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    queries = synthetic_queries(args.queries)
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+
+    results = {
+        "revision": _git_revision(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": vars(args),
+        "catalogs": [],
+    }
+    try:
+        for size in sizes:
+            print(f"⏱️  Catalog {size} products…")
+            results["catalogs"].append(bench_catalog(size, workdir, queries, args.embed_batch))
+
+        print(f"⏱️  RAG corpus {args.rag_chunks} chunks…")
+        rag_coll, results["rag"] = bench_rag(args.rag_chunks, workdir, queries)
+
+        llm = None
+        if args.gguf:
+            from llama_cpp import Llama
+            llm = Llama(model_path=args.gguf, n_ctx=4096, verbose=False)
+
+        print("⏱️  Prompt assembly…")
+        results["prompt"] = bench_prompt(llm or WhitespaceTokenizerLLM(), rag_coll, queries)
+        results["prompt"]["tokenizer"] = "gguf" if llm else "whitespace-stub"
+
+        if llm:
+            print("⏱️  LLM generation…")
+            results["llm"] = bench_llm(llm, queries, args.llm_queries)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
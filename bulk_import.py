@@ -0,0 +1,201 @@
+import os
+import re
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+MAX_BATCH_OPS = 500   # Firestore limit per WriteBatch commit
+OPTIONAL_FIELDS = ("gender", "color", "in_stock", "sku")
+
+
+# ---------- Input ----------
+def read_rows(path):
+    """Yield raw row dicts from a .csv or .jsonl file."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    print(f"⚠️ Skipping line {line_no}: invalid JSON ({e})")
+
+def natural_key(row):
+    """Stable Firestore document id: the SKU if present, else a slug of the name."""
+    raw = str(row.get("sku") or row.get("name") or "").strip().lower()
+    return re.sub(r"[^a-z0-9]+", "-", raw).strip("-")
+
+def normalize_row(row, base_dir):
+    """Return (key, product dict, local image path or None), or None if the row is unusable."""
+    name = str(row.get("name") or "").strip()
+    if not name:
+        return None
+    try:
+        price = float(row.get("price"))
+    except (TypeError, ValueError):
+        print(f"⚠️ Skipping {name!r}: invalid price {row.get('price')!r}")
+        return None
+
+    product = {
+        "name": name,
+        "price": price,
+        "category": str(row.get("category") or "").strip(),
+        "description": str(row.get("description") or "").strip(),
+    }
+    for k in OPTIONAL_FIELDS:
+        if row.get(k) not in (None, ""):
+            product[k] = row[k]
+    if isinstance(product.get("in_stock"), str):
+        product["in_stock"] = product["in_stock"].strip().lower() in ("1", "true", "yes", "y")
+
+    # image: a URL is stored as-is, anything else is a local file to upload
+    image = str(row.get("image") or row.get("image_path") or "").strip()
+    image_path = None
+    if image.startswith(("http://", "https://")):
+        product["image"] = image
+    elif image:
+        image_path = image if os.path.isabs(image) else os.path.join(base_dir, image)
+        product["image_source"] = image
+
+    return natural_key(row), product, image_path
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# ---------- Import ----------
+def fetch_existing(db, keys):
+    """Existing product docs for the given natural keys, read in batched get_all calls."""
+    coll = db.collection("products")
+    existing = {}
+    for chunk in chunked(keys, 300):
+        for snap in db.get_all([coll.document(k) for k in chunk]):
+            if snap.exists:
+                existing[snap.id] = snap.to_dict() or {}
+    return existing
+
+def upload_images(rows, existing, workers):
+    """Upload local images in parallel; reruns reuse the URL already stored for the same source."""
+    from cloudinary_utils import upload_file_to_cloudinary
+
+    def upload(item):
+        key, product, image_path = item
+        prev = existing.get(key, {})
+        if prev.get("image") and prev.get("image_source") == product.get("image_source"):
+            product["image"] = prev["image"]
+            return True
+        try:
+            with open(image_path, "rb") as f:
+                url = upload_file_to_cloudinary(f)
+        except OSError as e:
+            print(f"⚠️ Cannot read image for {product['name']!r}: {e}")
+            url = None
+        if url:
+            product["image"] = url
+        return bool(url)
+
+    todo = [r for r in rows if r[2]]
+    if not todo:
+        return 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ok = sum(pool.map(upload, todo))
+    print(f"🖼️  Images ready: {ok}/{len(todo)}")
+    return ok
+
+def write_products(db, rows, existing, in_flight):
+    """Write products with WriteBatch commits of up to 500 ops, several commits in flight."""
+    coll = db.collection("products")
+
+    def commit(chunk):
+        batch = db.batch()
+        for key, product, _ in chunk:
+            data = dict(product)
+            if key not in existing:
+                data["created_at"] = firestore.SERVER_TIMESTAMP
+            batch.set(coll.document(key), data, merge=True)
+        batch.commit()
+        return len(chunk)
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=in_flight) as pool:
+        for n in pool.map(commit, chunked(rows, MAX_BATCH_OPS)):
+            written += n
+            print(f"📝 Written {written}/{len(rows)} products")
+    return written
+
+def refresh_product_index(rows):
+    """Upsert the imported products into the semantic index once, at the end."""
+    import chatbot_logic
+
+    client = chatbot_logic.get_chroma_client(chatbot_logic.RAG_DIR)
+    coll = client.get_or_create_collection("products", embedding_function=chatbot_logic.get_embedding_function())
+    embedded = metadata_only = 0
+    for chunk in chunked([{**p, "id": key} for key, p, _ in rows], 1000):
+        e, m = chatbot_logic.upsert_products(coll, chunk)
+        embedded += e
+        metadata_only += m
+    print(f"🔎 Product index refreshed: {embedded} embedded, {metadata_only} metadata-only")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk import products from CSV/JSONL into Firestore. "
+                    "While app.py is running it owns the product semantic index: its catalog listener picks up "
+                    "the imported products and indexes them in batches, so leave --refresh-index off. "
+                    "Use --refresh-index only when the app is stopped (Chroma's store is single-process)."
+    )
+    parser.add_argument("path", help="products .csv or .jsonl file")
+    parser.add_argument("--upload-workers", type=int, default=8, help="parallel Cloudinary uploads")
+    parser.add_argument("--batches-in-flight", type=int, default=4, help="concurrent WriteBatch commits")
+    parser.add_argument("--refresh-index", action="store_true",
+                        help="update the product semantic index from this process (only while app.py is stopped)")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    base_dir = os.path.dirname(os.path.abspath(args.path))
+
+    # Last row wins for duplicate keys, so the import is idempotent within a file too
+    by_key = {}
+    for raw in read_rows(args.path):
+        parsed = normalize_row(raw, base_dir)
+        if parsed and parsed[0]:
+            by_key[parsed[0]] = parsed
+    rows = list(by_key.values())
+    print(f"📄 {len(rows)} products to import from {args.path}")
+    if not rows:
+        return
+
+    cred = credentials.Certificate("serviceAccountKey.json")
+    firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    existing = fetch_existing(db, list(by_key))
+    upload_images(rows, existing, args.upload_workers)
+
+    # Rows whose image upload failed are not written (a rerun retries them)
+    failed = [r for r in rows if r[2] and not r[1].get("image")]
+    for _, product, _ in failed:
+        print(f"⚠️ Skipping {product['name']!r}: image upload failed")
+    rows = [r for r in rows if not (r[2] and not r[1].get("image"))]
+
+    written = write_products(db, rows, existing, args.batches_in_flight)
+    if args.refresh_index and written:
+        refresh_product_index(rows)
+
+    elapsed = time.monotonic() - started
+    print(f"🎉 Imported {written} products in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.1f} products/sec)")
+
+
+if __name__ == "__main__":
+    main()
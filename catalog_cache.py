@@ -0,0 +1,362 @@
+import base64
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from query_filters import price_value
+
+SORT_FIELDS = ("name", "price", "created")
+# Fields with an equality index for has_match()
+FACET_FIELDS = ("category", "gender", "color", "in_stock")
+
+
+def _sort_value(field, product):
+    """JSON-serialisable sort value for a product; missing values sort first."""
+    if field == "name":
+        return str(product.get("name") or "").lower()
+    if field == "price":
+        try:
+            return float(product.get("price") or 0)
+        except (TypeError, ValueError):
+            return 0.0
+    if field == "created":
+        created = product.get("created_at")
+        return created.timestamp() if isinstance(created, datetime) else 0.0
+    raise ValueError(f"unsupported sort field: {field}")
+
+
+def _in_price_range(product, price_min, price_max):
+    price = price_value(product.get("price"))
+    return price is not None and (price_min is None or price >= price_min) and (price_max is None or price <= price_max)
+
+
+def _facet_key(value):
+    # bools apart from ints (True == 1), matching the `is True` stock filter
+    return (isinstance(value, bool), value)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        value, pid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("invalid cursor")
+    return (value, pid)
+
+
+class CatalogCache:
+    """
+    In-process copy of the Firestore `products` collection.
+    Seeded once from the first snapshot of an on_snapshot listener, which then
+    keeps it current, so request handlers read the catalog from memory. Facet (equality)
+    and price indexes answer has_match() without scanning the catalog.
+    `version` increases every time the cached catalog actually changes and can be
+    used as a cache key by other layers (semantic index, response cache, ...).
+    """
+
+    def __init__(self, db, collection_name="products"):
+        self.db = db
+        self.collection_name = collection_name
+        self._lock = threading.RLock()
+        self._products = {}
+        self._version = 0
+        self._ready = threading.Event()
+        self._unsubscribe = None
+        self._subscribers = []
+        self._sorted = {}   # (sort field, category) -> (version, ascending list of (sort value, id))
+        # Facet index: category -> ids, with a per-category version for the sorted views
+        self._by_category = {}
+        self._category_versions = {}
+        self._distinct = {}   # field -> (version, sorted distinct values)
+        self._facets = {f: {} for f in FACET_FIELDS}   # field -> value -> ids
+        self._prices = (-1, [], [])   # (version, ascending prices, ids in the same order)
+
+    # ---------- lifecycle ----------
+    def start(self, wait=True):
+        """
+        Attach the realtime listener; its first snapshot seeds the cache.
+        If attaching fails it is retried with backoff on a background thread.
+        With wait=False this returns right away; use wait_ready().
+        """
+        if not self._attach():
+            threading.Thread(target=self._retry_attach, name="catalog-listener-retry", daemon=True).start()
+        if wait:
+            self._ready.wait()
+        return self
+
+    def _attach(self):
+        try:
+            self._unsubscribe = self.db.collection(self.collection_name).on_snapshot(self._on_snapshot)
+            return True
+        except Exception as e:
+            print(f"❌ Failed to attach catalog listener: {e}")
+            return False
+
+    def _retry_attach(self, initial_backoff=1.0, max_backoff=60.0):
+        backoff = initial_backoff
+        while True:
+            print(f"🔁 Retrying catalog listener in {backoff:.0f}s")
+            time.sleep(backoff)
+            if self._attach():
+                return
+            backoff = min(backoff * 2, max_backoff)
+
+    def _seed(self, docs):
+        seeded = {}
+        for doc in docs:
+            d = doc.to_dict() or {}
+            d["id"] = doc.id
+            seeded[doc.id] = d
+        with self._lock:
+            self._products = seeded
+            self._by_category = {}
+            self._facets = {f: {} for f in FACET_FIELDS}
+            for pid, p in seeded.items():
+                self._by_category.setdefault(p.get("category"), set()).add(pid)
+                self._index_facets(pid, None, p)
+            self._category_versions = {}
+            self._sorted = {}
+            self._version += 1
+        print(f"✅ Catalog cache seeded with {len(seeded)} products")
+
+    def stop(self):
+        if self._unsubscribe is not None:
+            try:
+                self._unsubscribe.unsubscribe()
+            except AttributeError:
+                self._unsubscribe()
+            self._unsubscribe = None
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    # ---------- listener ----------
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        if not self._ready.is_set():
+            # The first snapshot holds the whole collection: bulk-load it (no per-product
+            # compare or subscriber calls) instead of a separate stream() read
+            try:
+                self._seed(col_snapshot)
+            except Exception as e:
+                print(f"❌ Failed to seed catalog cache: {e}")
+                return
+            self._ready.set()
+            return
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED":
+                self.remove(doc.id)
+            else:
+                d = doc.to_dict() or {}
+                d["id"] = doc.id
+                self.put(doc.id, d)
+
+    def subscribe(self, callback):
+        """
+        Register callback(kind, product_id, product) called after every change
+        applied to the cache. kind is "upsert" or "remove"; product is None on remove.
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, kind, pid, product):
+        for cb in list(self._subscribers):
+            try:
+                cb(kind, pid, product)
+            except Exception as e:
+                print(f"⚠️ Catalog subscriber failed for {pid}: {e}")
+
+    # ---------- writes ----------
+    def _index_category(self, pid, old, new):
+        # caller holds the lock
+        old_cat = old.get("category") if old is not None else None
+        new_cat = new.get("category") if new is not None else None
+        if old is not None:
+            ids = self._by_category.get(old_cat)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self._by_category[old_cat]
+            self._category_versions[old_cat] = self._category_versions.get(old_cat, 0) + 1
+        if new is not None:
+            self._by_category.setdefault(new_cat, set()).add(pid)
+            if new_cat != old_cat or old is None:
+                self._category_versions[new_cat] = self._category_versions.get(new_cat, 0) + 1
+
+    def _index_facets(self, pid, old, new):
+        # caller holds the lock
+        for field, index in self._facets.items():
+            try:
+                if old is not None and old.get(field) is not None:
+                    key = _facet_key(old[field])
+                    ids = index.get(key)
+                    if ids is not None:
+                        ids.discard(pid)
+                        if not ids:
+                            del index[key]
+                if new is not None and new.get(field) is not None:
+                    index.setdefault(_facet_key(new[field]), set()).add(pid)
+            except TypeError:
+                pass   # unhashable value (list, map): can't equal a parsed filter anyway
+
+    def put(self, pid, product):
+        """
+        Insert or replace a product. Also used by the admin endpoints right after a
+        Firestore write so the change is visible before the listener echoes it back.
+        Returns True if the cached catalog changed.
+        """
+        product = dict(product)
+        product["id"] = pid
+        with self._lock:
+            old = self._products.get(pid)
+            if old == product:
+                return False
+            self._products[pid] = product
+            self._index_category(pid, old, product)
+            self._index_facets(pid, old, product)
+            self._version += 1
+        self._notify("upsert", pid, product)
+        return True
+
+    def remove(self, pid):
+        with self._lock:
+            if pid not in self._products:
+                return False
+            old = self._products.pop(pid)
+            self._index_category(pid, old, None)
+            self._index_facets(pid, old, None)
+            self._version += 1
+        self._notify("remove", pid, None)
+        return True
+
+    # ---------- reads ----------
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, pid):
+        with self._lock:
+            p = self._products.get(pid)
+            return dict(p) if p is not None else None
+
+    def all(self):
+        """Return a list of product dicts (copies, safe for callers to mutate)."""
+        with self._lock:
+            return [dict(p) for p in self._products.values()]
+
+    def categories(self):
+        """Sorted list of non-empty category names (maintained incrementally)."""
+        with self._lock:
+            return sorted(c for c in self._by_category if c)
+
+    def category_counts(self):
+        with self._lock:
+            return {c: len(ids) for c, ids in self._by_category.items() if c}
+
+    def distinct(self, field):
+        """Sorted distinct non-empty values of a product field (recomputed only when the catalog changes)."""
+        with self._lock:
+            cached = self._distinct.get(field)
+            if cached is None or cached[0] != self._version:
+                values = sorted({str(p[field]) for p in self._products.values() if p.get(field) not in (None, "")})
+                cached = self._distinct[field] = (self._version, values)
+            return cached[1]
+
+    def _price_index(self):
+        # caller holds the lock; rebuilt lazily when the catalog changed
+        if self._prices[0] != self._version:
+            keys = sorted((price, pid) for pid, price in ((pid, price_value(p.get("price"))) for pid, p in self._products.items())
+                          if price is not None)
+            self._prices = (self._version, [k[0] for k in keys], [k[1] for k in keys])
+        return self._prices[1], self._prices[2]
+
+    def has_match(self, equals=None, price_min=None, price_max=None):
+        """
+        True if some product has every field in `equals` (FACET_FIELDS only) equal to
+        the given value and a price within [price_min, price_max]. Uses the facet and
+        price indexes: only the smallest candidate set is walked, never the whole catalog.
+        """
+        with self._lock:
+            candidates = []
+            for field, value in (equals or {}).items():
+                try:
+                    ids = self._facets[field].get(_facet_key(value))
+                except TypeError:
+                    ids = None
+                if not ids:
+                    return False
+                candidates.append(ids)
+            if price_min is not None or price_max is not None:
+                prices, price_ids = self._price_index()
+                lo = bisect_left(prices, price_min) if price_min is not None else 0
+                hi = bisect_right(prices, price_max) if price_max is not None else len(prices)
+                if lo >= hi:
+                    return False
+                if not candidates:
+                    return True
+                candidates.sort(key=len)
+                if hi - lo < len(candidates[0]):
+                    return any(all(pid in ids for ids in candidates) for pid in price_ids[lo:hi])
+                in_range = lambda pid: _in_price_range(self._products[pid], price_min, price_max)
+            else:
+                if not candidates:
+                    return bool(self._products)
+                candidates.sort(key=len)
+                in_range = lambda pid: True
+            smallest, rest = candidates[0], candidates[1:]
+            return any(all(pid in ids for ids in rest) and in_range(pid) for pid in smallest)
+
+    def _sorted_keys(self, field, category=None):
+        # caller holds the lock; rebuilt lazily, and for a category only from that
+        # category's rows and only when that category changed
+        if category is None:
+            version, pids = self._version, self._products.keys()
+        else:
+            version, pids = self._category_versions.get(category, 0), self._by_category.get(category, ())
+        cached = self._sorted.get((field, category))
+        if cached is None or cached[0] != version:
+            keys = sorted((_sort_value(field, self._products[pid]), pid) for pid in pids)
+            cached = self._sorted[(field, category)] = (version, keys)
+        return cached[1]
+
+    def page(self, sort="name", descending=False, cursor=None, limit=24, category=None):
+        """
+        One page of products in a stable (sort value, id) order.
+        cursor is the opaque next_cursor of the previous page. Returns
+        (products, next_cursor); next_cursor is None on the last page.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"unsupported sort field: {sort}")
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        after = decode_cursor(cursor) if cursor else None
+        next_cursor = None
+        with self._lock:
+            keys = self._sorted_keys(sort, category)
+            try:
+                if descending:
+                    start = (bisect_left(keys, after) if after else len(keys)) - 1
+                    positions = range(start, -1, -1)
+                else:
+                    start = bisect_right(keys, after) if after else 0
+                    positions = range(start, len(keys))
+            except TypeError:
+                # cursor was issued for a different sort field
+                raise ValueError("invalid cursor")
+            page = positions[:limit]
+            out = [dict(self._products[keys[i][1]]) for i in page]
+            if len(positions) > limit:
+                next_cursor = encode_cursor(keys[page[-1]])
+        return out, next_cursor
+
+    def __len__(self):
+        return len(self._products)
@@ -1,12 +1,13 @@
 import os
-import time
-from datetime import datetime
+import queue
+import socket
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
  
 # ------------- LLM / RAG deps -------------
 from llama_cpp import Llama
-import chromadb
-from chromadb.utils import embedding_functions
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chatbot_logic import cached_prompt_tokens, warm_prompt_prefix, open_rag_collection
  
 # ------------- Firebase / Firestore -------------
 import firebase_admin
@@ -19,30 +20,12 @@ RAG_DIR = os.path.join(BASE, "rag", "index")
 DOCS_DIR = os.path.join(BASE, "rag", "docs")
  
 # ---------- RAG ----------
-def build_rag_if_missing():
-    client = chromadb.PersistentClient(path=RAG_DIR)
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-small-en-v1.5"
-    )
-    coll = client.get_or_create_collection("local_docs", embedding_function=ef)
- 
-    if coll.count() > 0:
-        return coll
- 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=120)
-    docs, ids = [], []
-    i = 0
-    for root, _, files in os.walk(DOCS_DIR):
-        for fn in files:
-            if fn.lower().endswith((".txt", ".md")):
-                with open(os.path.join(root, fn), "r", encoding="utf-8", errors="ignore") as f:
-                    text = f.read()
-                for chunk in splitter.split_text(text):
-                    docs.append(chunk)
-                    ids.append(f"{fn}-{i}")
-                    i += 1
-    if docs:
-        coll.add(documents=docs, ids=ids)
+def open_rag():
+    # Workers only read the index: Chroma's store is single-process, and many workers
+    # may run at once. Ingest with ingest_docs.py or app.py's /api/admin/rag/ingest.
+    coll = open_rag_collection(path=RAG_DIR)
+    if coll.count() == 0:
+        print("⚠️ RAG index is empty; run ingest_docs.py (or POST /api/admin/rag/ingest) to add documents")
     return coll
  
 def rag_query(coll, query, k=4):
@@ -98,9 +81,11 @@ def load_llm(
     )
  
  
+SYSTEM = "You are Julia, a helpful local AI assistant. Use the CONTEXT when relevant."
+ 
 def chat(llm, user_text, context):
-    system = "You are Julia, a helpful local AI assistant. Use the CONTEXT when relevant."
-    prompt = f"<s>[INST] <<SYS>>{system}<</SYS>>\nCONTEXT:\n{context}\n\nUSER:\n{user_text}\n[/INST]"
+    # Resumes from the saved KV state of the constant system-prompt prefix
+    prompt = cached_prompt_tokens(llm, user_text, context, system=SYSTEM)
     out = llm(prompt, max_tokens=512, temperature=0.6, stop=["</s>", "[INST]"])
     reply = out["choices"][0]["text"].strip()
     return reply   # return plain model text (no "Julia: " prefix)
@@ -120,13 +105,70 @@ def init_firestore():
             firebase_admin.initialize_app()  # ADC
     return firestore.client()
  
+# ---------- Message claiming ----------
+def claim_message(db, doc_ref, worker_id, lease_seconds):
+    """
+    Atomically move a message pending -> processing (or take over an expired lease).
+    Returns the message data if this worker now owns it, else None.
+    """
+    transaction = db.transaction()
+ 
+    @firestore.transactional
+    def _claim(transaction):
+        snap = doc_ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        data = snap.to_dict() or {}
+        status = (data.get("status") or "").lower()
+        now = datetime.now(timezone.utc)
+        lease = data.get("lease_expires_at")
+        if status == "processing" and lease is not None and lease > now:
+            return None  # someone else holds a live lease
+        if status not in ("pending", "processing"):
+            return None
+        transaction.update(doc_ref, {
+            "status": "processing",
+            "worker_id": worker_id,
+            "lease_expires_at": now + timedelta(seconds=lease_seconds),
+            "attempts": int(data.get("attempts") or 0) + 1,
+            "claimed_at": firestore.SERVER_TIMESTAMP,
+        })
+        data["attempts"] = int(data.get("attempts") or 0) + 1
+        return data
+ 
+    return _claim(transaction)
+ 
+def finish_message(db, doc_ref, worker_id, fields):
+    """Write the outcome only if this worker still owns the message (its lease was not reclaimed)."""
+    transaction = db.transaction()
+ 
+    @firestore.transactional
+    def _finish(transaction):
+        snap = doc_ref.get(transaction=transaction)
+        data = (snap.to_dict() or {}) if snap.exists else {}
+        if data.get("status") != "processing" or data.get("worker_id") != worker_id:
+            return False
+        transaction.update(doc_ref, {**fields, "lease_expires_at": firestore.DELETE_FIELD})
+        return True
+ 
+    return _finish(transaction)
+ 
 # ---------- MAIN ----------
 def main():
-    print("🔧 Building/Loading RAG…")
-    coll = build_rag_if_missing()
+    parser = argparse.ArgumentParser(description="Chatbot worker: claims pending messages and writes replies.")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="unique id of this worker process")
+    parser.add_argument("--lease", type=int, default=300, help="seconds a claimed message stays owned by this worker")
+    parser.add_argument("--max-attempts", type=int, default=3, help="give up on a message after this many claims")
+    parser.add_argument("--reclaim-interval", type=int, default=60, help="seconds between scans for expired leases")
+    args = parser.parse_args()
+    worker_id = args.worker_id
+ 
+    print("🔧 Opening RAG index…")
+    coll = open_rag()
  
     print("🧠 Loading LLM…")
     llm = load_llm()
+    warm_prompt_prefix(llm, system=SYSTEM)
  
     print("☁️  Connecting to Firestore…")
     db = init_firestore()
@@ -136,91 +178,129 @@ def main():
     # Listen only to pending messages
     query_ref = messages_ref.where("status", "==", "pending")
  
-    print("✅ Watching 'messages' (status == 'pending') and writing replies to 'reply'…\n")
+    print(f"✅ Worker {worker_id} watching 'messages' (status == 'pending') and writing replies to 'reply'…\n")
+ 
+    # The listener only hands document refs to the processing thread; any number of
+    # worker processes can watch the same query because each message is claimed in a transaction.
+    work = queue.Queue()
+    stop_event = threading.Event()
  
     def on_snapshot(col_snapshot, changes, read_time):
         for change in changes:
             if change.type.name not in ("ADDED", "MODIFIED"):
                 continue
+            work.put(change.document.reference)
  
-            doc = change.document
-            data = doc.to_dict() or {}
-            status = (data.get("status") or "").lower()
-            text = (data.get("text") or "").strip()
-            if status != "pending" or not text:
-                continue
- 
-            conv_id = data.get("conv_id", "")
-            role = data.get("role", "")
-            created_at = data.get("created_at", "")
-            print("----- NEW MESSAGE --------------------------------")
-            print(f"conv_id: {conv_id}")
-            print(f"role:    {role}")
-            print(f"time:    {created_at}")
-            print(f"status:  {status}")
-            print(f"TEXT ->  {text}")
-            print("--------------------------------------------------")
- 
-            # Build context & query LLM
+    def reclaim_expired():
+        # Messages stuck in 'processing' after a worker died become claimable once the lease expires
+        while not stop_event.wait(args.reclaim_interval):
+            now = datetime.now(timezone.utc)
             try:
-                context = rag_query(coll, text)
-                reply = chat(llm, text, context)
+                for snap in messages_ref.where("status", "==", "processing").stream():
+                    lease = (snap.to_dict() or {}).get("lease_expires_at")
+                    if lease is None or lease <= now:
+                        work.put(snap.reference)
             except Exception as e:
-                print(f"❌ LLM error: {e}")
-                try:
-                    doc.reference.update(
-                        {
-                            "status": "error",
-                            "error_message": str(e),
-                            "processed_at": firestore.SERVER_TIMESTAMP,
-                        }
-                    )
-                except Exception as ue:
-                    print(f"❌ Failed to update error status: {ue}")
-                continue
- 
-            print("REPLY -----------------------------------------")
-            print(reply)
-            print("--------------------------------------------------\n")
- 
-            # Mark original message as processed
+                print(f"⚠️ Reclaim scan failed: {e}")
+ 
+    def process(doc_ref):
+        try:
+            data = claim_message(db, doc_ref, worker_id, args.lease)
+        except Exception as e:
+            print(f"⚠️ Could not claim {doc_ref.id}: {e}")
+            return
+        if data is None:
+            return  # already taken by another worker
+ 
+        text = (data.get("text") or "").strip()
+        if not text or data.get("attempts", 1) > args.max_attempts:
             try:
-                doc.reference.update(
-                    {
-                        "reply": reply,
-                        "status": "replied",
-                        "role": "assistant",
-                        "processed_at": firestore.SERVER_TIMESTAMP,
-                    }
-                )
+                finish_message(db, doc_ref, worker_id, {
+                    "status": "error",
+                    "error_message": "empty message" if not text else f"gave up after {args.max_attempts} attempts",
+                    "processed_at": firestore.SERVER_TIMESTAMP,
+                })
             except Exception as ue:
-                print(f"Could not update message with reply: {ue}")
- 
-            # ---- Write reply into its own collection 'reply' ----
+                print(f"❌ Failed to update error status: {ue}")
+            return
+ 
+        conv_id = data.get("conv_id", "")
+        role = data.get("role", "")
+        created_at = data.get("created_at", "")
+        print("----- NEW MESSAGE --------------------------------")
+        print(f"conv_id: {conv_id}")
+        print(f"role:    {role}")
+        print(f"time:    {created_at}")
+        print(f"worker:  {worker_id} (attempt {data.get('attempts')})")
+        print(f"TEXT ->  {text}")
+        print("--------------------------------------------------")
+ 
+        # Build context & query LLM
+        try:
+            context = rag_query(coll, text)
+            reply = chat(llm, text, context)
+        except Exception as e:
+            print(f"❌ LLM error: {e}")
             try:
-                reply_ref.add(
-                    {
-                        "created_at": firestore.SERVER_TIMESTAMP,
-                        "text": reply,
-                        # If you later want to link it back:
-                        # "conv_id": conv_id,
-                        # "source_message_id": doc.id,
-                    }
-                )
-            except Exception as we:
-                print(f"⚠️ Could not write to 'reply': {we}")
- 
-    # Start realtime listener
-    stop = query_ref.on_snapshot(on_snapshot)
+                finish_message(db, doc_ref, worker_id, {
+                    "status": "error",
+                    "error_message": str(e),
+                    "processed_at": firestore.SERVER_TIMESTAMP,
+                })
+            except Exception as ue:
+                print(f"❌ Failed to update error status: {ue}")
+            return
+ 
+        print("REPLY -----------------------------------------")
+        print(reply)
+        print("--------------------------------------------------\n")
+ 
+        # Mark original message as processed (only if our lease was not taken over)
+        try:
+            owned = finish_message(db, doc_ref, worker_id, {
+                "reply": reply,
+                "status": "replied",
+                "role": "assistant",
+                "processed_at": firestore.SERVER_TIMESTAMP,
+            })
+        except Exception as ue:
+            print(f"Could not update message with reply: {ue}")
+            return
+        if not owned:
+            print(f"⚠️ Lease on {doc_ref.id} was reclaimed by another worker; discarding reply")
+            return
+ 
+        # ---- Write reply into its own collection 'reply' ----
+        try:
+            reply_ref.add(
+                {
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                    "text": reply,
+                    # If you later want to link it back:
+                    # "conv_id": conv_id,
+                    # "source_message_id": doc_ref.id,
+                }
+            )
+        except Exception as we:
+            print(f"⚠️ Could not write to 'reply': {we}")
+ 
+    # Start realtime listener and the lease reaper
+    watch = query_ref.on_snapshot(on_snapshot)
+    threading.Thread(target=reclaim_expired, name="lease-reaper", daemon=True).start()
  
     try:
         while True:
-            time.sleep(1)
+            try:
+                doc_ref = work.get(timeout=1)
+            except queue.Empty:
+                continue
+            process(doc_ref)
     except KeyboardInterrupt:
         print("\n⏹️  Stopping listener…")
-        stop()
+        stop_event.set()
+        watch.unsubscribe()
+ 
+ 
  
-
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,59 +1,250 @@
 import os
-from llama_cpp import Llama
+import json
+import hashlib
+import time
+import threading
+from itertools import islice
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import chromadb
 from chromadb.utils import embedding_functions
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from query_filters import price_value
+
 # ---------- CONFIG ----------
 BASE = os.path.dirname(os.path.abspath(__file__))
 LLM_PATH = os.path.join(BASE, "models", "llm", "mistral-7b-instruct-v0.2.Q4_K_M.gguf")
+# Optional smaller GGUF used under heavy load (see degradation.py); same prompt format expected
+SMALL_LLM_PATH = os.getenv("SMALL_LLM_PATH", "")
 RAG_DIR = os.path.join(BASE, "rag", "index")
 DOCS_DIR = os.path.join(BASE, "rag", "docs")
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
+_embedding_function = None
+_chroma_clients = {}
+_rag_version = 0
+# Guards the lazy singletons above: warm-up and the first requests race to create them
+_init_lock = threading.Lock()
+
+def get_embedding_function():
+    """Process-wide sentence-transformer embedding function (loaded on first use)."""
+    global _embedding_function
+    if _embedding_function is None:
+        with _init_lock:
+            if _embedding_function is None:
+                _embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                    model_name=EMBED_MODEL
+                )
+    return _embedding_function
+
+def get_chroma_client(path=RAG_DIR):
+    """One PersistentClient per index path, reused by every builder and query."""
+    client = _chroma_clients.get(path)
+    if client is None:
+        with _init_lock:
+            client = _chroma_clients.get(path)
+            if client is None:
+                client = _chroma_clients[path] = chromadb.PersistentClient(path=path)
+    return client
+
+def embed_query(text):
+    """Embed a user query once so the vector can be shared by every collection query."""
+    return list(get_embedding_function()([text])[0])
+
+def embed_queries(texts):
+    """Embed several queries in one model call (much better CPU throughput than one by one)."""
+    return [list(v) for v in get_embedding_function()(list(texts))]
+
+def _query_input(query, query_embedding):
+    # Prefer a precomputed vector; fall back to letting chroma embed the text
+    if query_embedding is not None:
+        return {"query_embeddings": [query_embedding]}
+    return {"query_texts": [query]}
+
+def rag_index_version():
+    """Bumped whenever the RAG collection content changes in this process."""
+    return _rag_version
 
 # ---------- RAG ----------
-def build_rag_if_missing():
-    client = chromadb.PersistentClient(path=RAG_DIR)
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-small-en-v1.5"
-    )
-    coll = client.get_or_create_collection("local_docs", embedding_function=ef)
+RAG_COLLECTION = "local_docs"
+RAG_DOC_EXTENSIONS = (".txt", ".md")
+_rag_ingest_lock = threading.Lock()
 
-    if coll.count() > 0:
-        return coll
+def _read_json(json_path):
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _rag_manifest_path(path=RAG_DIR):
+    return os.path.join(path, f"{RAG_COLLECTION}.manifest.json")
 
+def _file_hash(abs_path):
+    h = hashlib.sha256()
+    with open(abs_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _chunk_doc(abs_path, rel_path):
+    """
+    Split one document into (chunk ids, chunks). Ids are derived from the file path
+    and the chunk text, so an edit only changes the ids of the chunks it touched.
+    """
     splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=120)
-    docs, ids = [], []
-    i = 0
-    for root, _, files in os.walk(DOCS_DIR):
+    with open(abs_path, "r", encoding="utf-8", errors="ignore") as f:
+        chunks = splitter.split_text(f.read())
+    ids, seen = [], {}
+    for chunk in chunks:
+        digest = hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16]
+        n = seen[digest] = seen.get(digest, 0) + 1
+        ids.append(f"{rel_path}::{digest}" + (f"-{n}" if n > 1 else ""))
+    return ids, chunks
+
+def scan_rag_docs(docs_dir=DOCS_DIR):
+    """{relative path: absolute path} of every ingestible document under docs_dir."""
+    found = {}
+    for root, _, files in os.walk(docs_dir):
         for fn in files:
-            if fn.lower().endswith((".txt", ".md")):
-                with open(os.path.join(root, fn), "r", encoding="utf-8", errors="ignore") as f:
-                    text = f.read()
-                for chunk in splitter.split_text(text):
-                    docs.append(chunk)
-                    ids.append(f"{fn}-{i}")
-                    i += 1
-    if docs:
-        coll.add(documents=docs, ids=ids)
+            if fn.lower().endswith(RAG_DOC_EXTENSIONS):
+                abs_path = os.path.join(root, fn)
+                found[os.path.relpath(abs_path, docs_dir).replace(os.sep, "/")] = abs_path
+    return found
+
+def _chunk_docs(docs, rels, workers):
+    """
+    {rel: (ids, chunks)} for the given documents. The text splitter is pure Python
+    (holds the GIL), so several files are split in worker processes; "spawn" because
+    the calling process (the app) runs threads and a loaded model.
+    """
+    if workers <= 1 or len(rels) < 2:
+        return {rel: _chunk_doc(docs[rel], rel) for rel in rels}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(rels)), mp_context=ctx) as pool:
+        return dict(zip(rels, pool.map(_chunk_doc, [docs[rel] for rel in rels], rels)))
+
+def ingest_rag_docs(docs_dir=DOCS_DIR, path=RAG_DIR, workers=4):
+    """
+    Incrementally sync the RAG collection with the files under docs_dir.
+    A manifest of {file: content hash} next to the index decides what to do:
+    unchanged files are skipped, new/changed files are re-chunked in up to `workers`
+    processes and only their new chunks embedded, and chunks of deleted files (or
+    chunks that vanished from a changed file) are removed. Safe to run while
+    the app is serving; concurrent calls are serialized.
+    Returns stats.
+    """
+    global _rag_version
+    with _rag_ingest_lock:
+        started = time.monotonic()
+        client = get_chroma_client(path)
+        coll = client.get_or_create_collection(RAG_COLLECTION, embedding_function=get_embedding_function())
+        manifest_path = _rag_manifest_path(path)
+        manifest = _read_json(manifest_path)
+        stats = {"files": 0, "changed": 0, "deleted": 0, "chunks_added": 0, "chunks_removed": 0}
+        files = (manifest or {}).get("files", {})
+        # A manifest is only written once a pre-manifest index has been cleared
+        legacy_cleared = manifest is not None
+        try:
+            if manifest is None and coll.count() > 0:
+                # Index built before manifests existed (ids "{fn}-{i}"): start over once
+                legacy_ids = coll.get(include=[]).get("ids", [])
+                coll.delete(ids=legacy_ids)
+                stats["chunks_removed"] += len(legacy_ids)
+            legacy_cleared = True
+
+            docs = scan_rag_docs(docs_dir)
+            # hashlib releases the GIL on large reads, so threads are enough for hashing
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                hashes = dict(zip(docs, pool.map(_file_hash, docs.values())))
+            changed = [rel for rel in docs if files.get(rel, {}).get("hash") != hashes[rel]]
+            deleted = [rel for rel in files if rel not in docs]
+            stats.update(files=len(docs), changed=len(changed), deleted=len(deleted))
+            chunked = _chunk_docs(docs, changed, workers)
+
+            for rel, (ids, chunks) in chunked.items():
+                old_ids = set(coll.get(where={"source": rel}, include=[]).get("ids", []))
+                new = [(i, c) for i, c in zip(ids, chunks) if i not in old_ids]
+                stale = list(old_ids - set(ids))
+                for j in range(0, len(new), 1000):
+                    part = new[j:j + 1000]
+                    coll.add(
+                        ids=[i for i, _ in part],
+                        documents=[c for _, c in part],
+                        metadatas=[{"source": rel, "file_hash": hashes[rel]}] * len(part),
+                    )
+                    stats["chunks_added"] += len(part)
+                if stale:
+                    coll.delete(ids=stale)
+                    stats["chunks_removed"] += len(stale)
+                files[rel] = {"hash": hashes[rel], "chunks": len(ids)}
+
+            for rel in deleted:
+                old_ids = coll.get(where={"source": rel}, include=[]).get("ids", [])
+                if old_ids:
+                    coll.delete(ids=old_ids)
+                    stats["chunks_removed"] += len(old_ids)
+                files.pop(rel, None)
+        finally:
+            # Even after a partial failure: chunks already added/removed are live, so
+            # response caches keyed on the RAG version must move on, and the manifest
+            # records the files that were fully synced (the rest is retried next run)
+            if stats["chunks_added"] or stats["chunks_removed"]:
+                _rag_version += 1
+            if legacy_cleared:
+                os.makedirs(path, exist_ok=True)
+                tmp = manifest_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"files": files, "updated_at": time.time()}, f)
+                os.replace(tmp, manifest_path)
+
+        stats["seconds"] = round(time.monotonic() - started, 2)
+        return coll, stats
+
+def open_rag_collection(path=RAG_DIR):
+    """
+    Open the RAG collection read-only (no ingestion), for processes that don't own
+    the index; the app (/api/admin/rag/ingest) or ingest_docs.py keep it current.
+    """
+    return get_chroma_client(path).get_or_create_collection(RAG_COLLECTION, embedding_function=get_embedding_function())
+
+def build_rag_if_missing():
+    """Open the RAG collection, ingesting any new/changed/deleted docs first (cheap when nothing changed)."""
+    coll, stats = ingest_rag_docs()
+    if stats["changed"] or stats["deleted"]:
+        print(f"📚 RAG docs ingested: {stats}")
     return coll
 
-def rag_query(coll, query, k=4):
-    res = coll.query(query_texts=[query], n_results=k)
-    docs = res.get("documents", [[]])[0]
-    return "\n\n".join(docs)
+def rag_query_chunks(coll, query, k=4, query_embedding=None):
+    """RAG chunks for the query, best match first."""
+    res = coll.query(n_results=k, **_query_input(query, query_embedding))
+    return res.get("documents", [[]])[0]
+
+def rag_query_chunks_batch(coll, query_embeddings, k=4):
+    """One multi-query call for several query vectors; returns a list of chunk lists."""
+    res = coll.query(query_embeddings=list(query_embeddings), n_results=k)
+    return res.get("documents") or [[] for _ in query_embeddings]
+
+def rag_query(coll, query, k=4, query_embedding=None):
+    return "\n\n".join(rag_query_chunks(coll, query, k=k, query_embedding=query_embedding))
 
 # ---------- LLM ----------
 def load_llm(
     gpu="auto",
     vram_gb=24,
     full_offload=True,
+    model_path=LLM_PATH,
 ):
     n_gpu_layers = 999 if full_offload else 30
     n_batch = 2048 if vram_gb <= 8 else 1024
     n_threads = max(1, (os.cpu_count() or 8) - 1)
     
+    # Imported here so the retrieval / indexing helpers (benchmark.py, ingest_docs.py,
+    # index_products.py) work on machines without the LLM stack
+    from llama_cpp import Llama
     return Llama(
-        model_path=LLM_PATH,
+        model_path=model_path,
         n_ctx=4096,
         n_threads=n_threads,
         n_gpu_layers=n_gpu_layers,
@@ -69,10 +260,8 @@ def build_product_index_if_missing(products, path=RAG_DIR, collection_name="prod
     products: list of dicts with keys: id, name, description, category, price, image, (optional) gender, etc.
     force_rebuild: if True, delete and rebuild the collection (useful when products change)
     """
-    client = chromadb.PersistentClient(path=path)
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-small-en-v1.5"
-    )
+    client = get_chroma_client(path)
+    ef = get_embedding_function()
     
     # If force_rebuild is True, delete the old collection
     if force_rebuild:
@@ -87,34 +276,246 @@ def build_product_index_if_missing(products, path=RAG_DIR, collection_name="prod
     if coll.count() > 0 and not force_rebuild:
         return coll
 
-    ids, docs, metadatas = [], [], []
-    for p in products:
-        pid = str(p.get("id") or p.get("product_id") or p.get("doc_id") or p.get("id_str") or "")
+    index_products_batched(products, coll)
+    return coll
+
+def load_index_checkpoint(checkpoint_path):
+    """Return the saved {"last_id", "indexed"} checkpoint, or None if there is none."""
+    if not checkpoint_path or not os.path.isfile(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_index_checkpoint(checkpoint_path, last_id, indexed):
+    tmp = checkpoint_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id, "indexed": indexed, "updated_at": time.time()}, f)
+    os.replace(tmp, checkpoint_path)
+
+def _embed_product_batch(ef, batch):
+    ids, docs, metas = [], [], []
+    for p in batch:
+        pid = _product_id(p)
         if not pid:
             continue
-        text = " | ".join([
-            str(p.get("name", "")).strip(),
-            str(p.get("category", "")).strip(),
-            str(p.get("description", "")).strip()
-        ])
         ids.append(pid)
-        docs.append(text)
-        metadatas.append({
-            "name": p.get("name"),
-            "category": p.get("category"),
-            "price": p.get("price"),
-            "image": p.get("image"),
-            **({k: p[k] for k in ("gender","color","in_stock") if k in p})
-        })
-
-    if docs:
-        coll.add(documents=docs, metadatas=metadatas, ids=ids)
-    return coll
+        docs.append(_product_document(p))
+        metas.append(_product_metadata(p))
+    embeddings = ef(docs) if docs else []
+    return ids, docs, metas, embeddings
+
+def index_products_batched(products, coll, batch_size=256, workers=2, checkpoint_path=None, progress_every=10, already_indexed=0):
+    """
+    Streaming product indexer for large catalogs.
+    products: any iterable of product dicts (e.g. a paged Firestore reader); it is
+    consumed batch by batch, so memory stays bounded by workers * batch_size.
+    Batches are embedded on `workers` threads and upserted in input order; after each
+    upsert the last product id is written to checkpoint_path so a crashed run can
+    resume from there (see load_index_checkpoint); pass the checkpoint's count as
+    already_indexed to keep the running total.
+    Returns the number of products indexed.
+    """
+    ef = get_embedding_function()
+    it = iter(products)
+    indexed, batches = 0, 0
+    started = time.monotonic()
+
+    def next_batch():
+        return list(islice(it, batch_size))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = []
+        # Keep a few batches in flight so embedding overlaps with upserts
+        for _ in range(max(1, workers) * 2):
+            batch = next_batch()
+            if not batch:
+                break
+            pending.append(pool.submit(_embed_product_batch, ef, batch))
+
+        while pending:
+            ids, docs, metas, embeddings = pending.pop(0).result()
+            batch = next_batch()
+            if batch:
+                pending.append(pool.submit(_embed_product_batch, ef, batch))
+            if not ids:
+                continue
+
+            coll.upsert(ids=ids, documents=docs, metadatas=metas, embeddings=embeddings)
+            indexed += len(ids)
+            batches += 1
+            if checkpoint_path:
+                _save_index_checkpoint(checkpoint_path, ids[-1], already_indexed + indexed)
+
+            if progress_every and batches % progress_every == 0:
+                elapsed = time.monotonic() - started
+                print(f"📦 Indexed {indexed} products ({indexed / elapsed:.1f} docs/sec)")
+
+    elapsed = time.monotonic() - started
+    if indexed:
+        print(f"✅ Indexed {indexed} products in {elapsed:.1f}s ({indexed / max(elapsed, 1e-9):.1f} docs/sec)")
+    return indexed
+
+def _product_id(p):
+    return str(p.get("id") or p.get("product_id") or p.get("doc_id") or p.get("id_str") or "")
+
+def _product_document(p):
+    """Text that gets embedded for a product: name | category | description."""
+    return " | ".join([
+        str(p.get("name", "")).strip(),
+        str(p.get("category", "")).strip(),
+        str(p.get("description", "")).strip()
+    ])
+
+def _product_metadata(p):
+    """Filterable metadata; price is numeric so where clauses can use $lte/$gte. None values are left out."""
+    meta = {
+        "name": p.get("name"),
+        "category": p.get("category"),
+        "price": price_value(p.get("price")),
+        "image": p.get("image"),
+        **({k: p[k] for k in ("gender","color","in_stock") if k in p})
+    }
+    return {k: v for k, v in meta.items() if v is not None}
+
+def upsert_products(coll, products):
+    """
+    Incrementally add/update products in the product collection.
+    Only products whose embedded text (name, category, description) changed are
+    re-embedded; metadata-only changes (price, image, ...) are applied without embedding.
+    Returns (embedded_count, metadata_only_count).
+    """
+    if coll is None:
+        return 0, 0
+
+    by_id = {}
+    for p in products:
+        pid = _product_id(p)
+        if pid:
+            by_id[pid] = p
+    if not by_id:
+        return 0, 0
+
+    existing = coll.get(ids=list(by_id), include=["documents"])
+    existing_docs = dict(zip(existing.get("ids", []), existing.get("documents", [])))
+
+    embed_ids, embed_docs, embed_metas = [], [], []
+    meta_ids, meta_metas = [], []
+    for pid, p in by_id.items():
+        doc = _product_document(p)
+        meta = _product_metadata(p)
+        if existing_docs.get(pid) == doc:
+            meta_ids.append(pid)
+            meta_metas.append(meta)
+        else:
+            embed_ids.append(pid)
+            embed_docs.append(doc)
+            embed_metas.append(meta)
+
+    if embed_ids:
+        coll.upsert(ids=embed_ids, documents=embed_docs, metadatas=embed_metas)
+    if meta_ids:
+        coll.update(ids=meta_ids, metadatas=meta_metas)
+    return len(embed_ids), len(meta_ids)
+
+def upsert_product(coll, product):
+    """Add or update a single product (see upsert_products)."""
+    return upsert_products(coll, [product])
+
+def delete_products(coll, product_ids):
+    """Remove products from the product collection so they stop showing up in search."""
+    ids = [str(pid) for pid in product_ids if pid]
+    if coll is None or not ids:
+        return 0
+    coll.delete(ids=ids)
+    return len(ids)
+
+def delete_product(coll, product_id):
+    return delete_products(coll, [product_id])
+
+# ---------- Startup sync (catalog fingerprint) ----------
+def _product_hash(p):
+    """Hash of everything a product contributes to the index (document + metadata)."""
+    payload = json.dumps([_product_document(p), _product_metadata(p)], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
-def product_index_query(coll, query, n_results=8, where=None):
+def catalog_fingerprint(hashes):
+    """Single hash over {product id: product hash} for the whole catalog."""
+    h = hashlib.sha256(EMBED_MODEL.encode("utf-8"))
+    for pid in sorted(hashes):
+        h.update(f"{pid}:{hashes[pid]}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def _fingerprint_path(path, collection_name):
+    return os.path.join(path, f"{collection_name}.fingerprint.json")
+
+def _save_fingerprint(fp_path, fingerprint, hashes):
+    os.makedirs(os.path.dirname(fp_path), exist_ok=True)
+    tmp = fp_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "model": EMBED_MODEL, "hashes": hashes, "updated_at": time.time()}, f)
+    os.replace(tmp, fp_path)
+
+def sync_product_index(products, path=RAG_DIR, collection_name="products"):
+    """
+    Bring the persisted product collection in line with `products` without a full rebuild.
+    If the stored catalog fingerprint matches, the index is reused as-is. Otherwise only
+    products whose hash changed are upserted (re-embedded only if their text changed,
+    see upsert_products) and products no longer in the catalog are deleted.
+    Returns (coll, stats).
+    """
+    client = get_chroma_client(path)
+    coll = client.get_or_create_collection(collection_name, embedding_function=get_embedding_function())
+
+    by_id = {}
+    for p in products:
+        pid = _product_id(p)
+        if pid:
+            by_id[pid] = p
+    hashes = {pid: _product_hash(p) for pid, p in by_id.items()}
+    fingerprint = catalog_fingerprint(hashes)
+
+    fp_path = _fingerprint_path(path, collection_name)
+    stored = _read_json(fp_path) or {}
+    stats = {"products": len(by_id), "reused": False, "embedded": 0, "metadata_only": 0, "deleted": 0}
+
+    if stored.get("fingerprint") == fingerprint and coll.count() == len(by_id):
+        stats["reused"] = True
+        return coll, stats
+
+    if stored.get("model") not in (None, EMBED_MODEL):
+        # Vectors from another embedding model can't be mixed with new ones
+        stored_hashes = {}
+        if coll.count():
+            client.delete_collection(collection_name)
+            coll = client.get_or_create_collection(collection_name, embedding_function=get_embedding_function())
+    else:
+        stored_hashes = stored.get("hashes") or {}
+
+    indexed_ids = set(coll.get(include=[]).get("ids", []))
+    changed = [p for pid, p in by_id.items() if pid not in indexed_ids or stored_hashes.get(pid) != hashes[pid]]
+    stale = [pid for pid in indexed_ids if pid not in by_id]
+
+    if not indexed_ids:
+        stats["embedded"] = index_products_batched(changed, coll)
+    else:
+        for i in range(0, len(changed), 1000):
+            e, m = upsert_products(coll, changed[i:i + 1000])
+            stats["embedded"] += e
+            stats["metadata_only"] += m
+    for i in range(0, len(stale), 1000):
+        stats["deleted"] += delete_products(coll, stale[i:i + 1000])
+
+    _save_fingerprint(fp_path, fingerprint, hashes)
+    return coll, stats
+
+def product_index_query(coll, query, n_results=8, where=None, query_embedding=None):
     """
     Query the product collection.
     where: optional metadata filter dict, e.g. {"gender": "male"}
+    query_embedding: optional precomputed vector (see embed_query) to skip re-embedding
     Returns list of dicts: {id, meta, distance}
     """
     if coll is None:
@@ -122,37 +523,240 @@ def product_index_query(coll, query, n_results=8, where=None):
 
     try:
         res = coll.query(
-            query_texts=[query],
             n_results=n_results,
             where=where,
+            **_query_input(query, query_embedding),
             include=["metadatas", "distances", "documents"]
         )
     except TypeError:
         # Fallback for older chroma versions
         res = coll.query(
-            query_texts=[query],
             n_results=n_results,
+            **_query_input(query, query_embedding),
             include=["metadatas", "distances", "documents"]
         )
 
-    ids = res.get("ids", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0] if "distances" in res else [None]*len(ids)
+    return _product_results(res, 0)
+
+def _product_results(res, i):
+    ids = res.get("ids", [[]])[i]
+    metas = res.get("metadatas", [[]])[i]
+    dists = res.get("distances", [[]])[i] if res.get("distances") else [None]*len(ids)
 
     out = []
-    for i, pid in enumerate(ids):
-        out.append({"id": pid, "meta": metas[i], "distance": dists[i]})
+    for j, pid in enumerate(ids):
+        out.append({"id": pid, "meta": metas[j], "distance": dists[j]})
+    return out
+
+def product_index_query_grouped(coll, requests):
+    """
+    Batched product search. requests: list of (query_embedding, where, n_results).
+    Requests sharing the same filter and n_results go out as a single multi-query
+    coll.query call. Returns one result list (as product_index_query) per request.
+    """
+    if coll is None:
+        return [[] for _ in requests]
+
+    groups = {}
+    for i, (_, where, n_results) in enumerate(requests):
+        key = (json.dumps(where, sort_keys=True), n_results)
+        groups.setdefault(key, []).append(i)
+
+    out = [None] * len(requests)
+    for (where_key, n_results), idxs in groups.items():
+        res = coll.query(
+            query_embeddings=[requests[i][0] for i in idxs],
+            n_results=n_results,
+            where=json.loads(where_key),
+            include=["metadatas", "distances", "documents"]
+        )
+        for pos, i in enumerate(idxs):
+            out[i] = _product_results(res, pos)
     return out
 
-def chat(llm, user_text, context):
-    system = """You are Julia, a helpful e-commerce assistant. 
+SYSTEM_PROMPT = """You are Julia, a helpful e-commerce assistant. 
     Use the CONTEXT provided to answer the user's question. 
     If the context contains 'Product Catalog', use it to find and recommend products.
     If the context contains 'Other Info', use it for general questions.
     Be friendly and concise."""
+
+STOP_SEQUENCES = ["</s>", "[INST]"]
+
+# Max tokens spent on CONTEXT (product matches + RAG chunks); n_ctx is 4096
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+# ---------- Prompt assembly ----------
+def count_tokens(llm, text):
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+def _shingles(text, n=5):
+    words = text.lower().split()
+    return {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+def dedupe_chunks(chunks, max_overlap=0.5):
+    """
+    Drop empty, duplicate and heavily overlapping chunks (the RAG splitter uses
+    chunk_overlap, so neighbouring chunks repeat text). Keeps the first, i.e.
+    best-ranked, occurrence. Returns (kept chunks, number dropped).
+    """
+    kept, seen = [], set()
+    for chunk in chunks:
+        chunk = (chunk or "").strip()
+        if not chunk:
+            continue
+        sh = _shingles(chunk)
+        if len(sh & seen) / len(sh) > max_overlap:
+            continue
+        kept.append(chunk)
+        seen |= sh
+    return kept, len(chunks) - len(kept)
+
+def prompt_window_budget(llm, user_text, max_tokens, system=SYSTEM_PROMPT):
+    """
+    Tokens left for the CONTEXT block in the model's window once the chat template,
+    system prompt, user message and `max_tokens` of reply are accounted for.
+    None when the model doesn't report its window.
+    """
+    if not hasattr(llm, "n_ctx"):
+        return None
+    overhead = len(_tokenize_prompt(llm, build_prompt(user_text, "", system)))
+    return max(0, llm.n_ctx() - overhead - max_tokens)
+
+def assemble_context(llm, product_lines, rag_chunks, budget=CONTEXT_TOKEN_BUDGET, user_text=None, max_tokens=0):
+    """
+    Build the CONTEXT block within `budget` tokens, counted with the model's tokenizer.
+    With user_text, the budget is also capped by what is left of the model's window
+    (see prompt_window_budget), so a long message can't push the prompt past n_ctx.
+    product_lines and rag_chunks must be in ranked order; items are added in that
+    order (products first) and anything that would overflow the budget is skipped.
+    Returns (context, stats).
+    """
+    if user_text is not None:
+        window = prompt_window_budget(llm, user_text, max_tokens)
+        if window is not None:
+            budget = min(budget, window)
+    product_header = "Product Catalog Context:\nProduct Catalog Matches:"
+    rag_header = "\n\nOther Info Context:\n"
+    used = count_tokens(llm, product_header) + count_tokens(llm, rag_header)
+
+    rag_chunks, duplicates = dedupe_chunks(rag_chunks)
+    dropped = 0
+
+    kept_lines = []
+    for line in product_lines:
+        cost = count_tokens(llm, "\n" + line)
+        if used + cost > budget:
+            dropped += 1
+            continue
+        kept_lines.append(line)
+        used += cost
+
+    kept_chunks = []
+    for chunk in rag_chunks:
+        cost = count_tokens(llm, chunk + "\n\n")
+        if used + cost > budget:
+            dropped += 1
+            continue
+        kept_chunks.append(chunk)
+        used += cost
+
+    product_context = "\n".join(["Product Catalog Matches:"] + kept_lines) if kept_lines else ""
+    context = f"Product Catalog Context:\n{product_context}{rag_header}" + "\n\n".join(kept_chunks)
+    stats = {
+        "context_tokens": used,
+        "context_budget": budget,
+        "dropped_duplicate_chunks": duplicates,
+        "dropped_over_budget": dropped,
+    }
+    return context, stats
+
+# Per-replica KV state after evaluating the constant system-prompt prefix:
+# (id(llm), system) -> (prefix tokens, LlamaState)
+_prefix_states = {}
+# (id(llm), system) already checked to tokenize as a prefix of the full prompt
+_prefix_checked = set()
+
+def build_prompt_prefix(system=SYSTEM_PROMPT):
+    """The part of the prompt that is identical for every request."""
+    return f"<s>[INST] <<SYS>>{system}<</SYS>>\n"
+
+def build_prompt_suffix(user_text, context):
+    return f"CONTEXT:\n{context}\n\nUSER:\n{user_text}\n[/INST]"
+
+def build_prompt(user_text, context, system=SYSTEM_PROMPT):
+    return build_prompt_prefix(system) + build_prompt_suffix(user_text, context)
+
+def _tokenize_prompt(llm, text):
+    # Same call llama-cpp makes for a string prompt: special=True turns "<s>" into BOS
+    return llm.tokenize(text.encode("utf-8"), special=True)
+
+def warm_prompt_prefix(llm, system=SYSTEM_PROMPT):
+    """
+    Evaluate the system-prompt prefix once on this model and keep its KV state,
+    so later requests only pay prompt-eval for their own context + question.
+    """
+    tokens = _tokenize_prompt(llm, build_prompt_prefix(system))
+    llm.reset()
+    llm.eval(tokens)
+    _prefix_states[(id(llm), system)] = (tokens, llm.save_state())
+    return tokens
+
+def cached_prompt_tokens(llm, user_text, context, system=SYSTEM_PROMPT):
+    """
+    Prompt as a token list, tokenized exactly like the string prompt would be.
+    If the model's KV cache no longer holds the prefix, the saved state is restored;
+    llama.cpp's own prefix matching then skips re-evaluating those tokens.
+    """
+    entry = _prefix_states.get((id(llm), system))
+    if entry is None:
+        warm_prompt_prefix(llm, system)
+        entry = _prefix_states[(id(llm), system)]
+    prefix_tokens, state = entry
+
+    n = len(prefix_tokens)
+    if llm.n_tokens < n or list(llm.input_ids[:n]) != prefix_tokens:
+        llm.load_state(state)
+
+    # Tokenize the whole prompt (not prefix + suffix separately) so the model sees
+    # the same tokens as with a string prompt
+    tokens = _tokenize_prompt(llm, build_prompt(user_text, context, system))
+    key = (id(llm), system)
+    if key not in _prefix_checked:
+        _prefix_checked.add(key)
+        if tokens[:n] != prefix_tokens:
+            print("⚠️ System prompt does not tokenize as a prefix of the full prompt; prefix cache will miss")
+    return tokens
+
+def chat(llm, user_text, context, usage=None, max_tokens=512):
+    """
+    usage: optional dict, filled with prompt/completion token counts for this call
+    and first_token_at (perf_counter when decoding started, after prompt eval).
+    """
+    # Streamed internally only to see when the first token arrives
+    return "".join(chat_stream(llm, user_text, context, usage=usage, max_tokens=max_tokens)).strip()
+
+def chat_stream(llm, user_text, context, usage=None, max_tokens=512):
+    """
+    Same as chat() but yields text pieces as llama.cpp produces them (stream=True),
+    so the first token reaches the client after prompt evaluation instead of after
+    the whole completion.
+    """
+    prompt = cached_prompt_tokens(llm, user_text, context)
+    if usage is not None:
+        usage["prompt_tokens"] = len(prompt)
+        usage["completion_tokens"] = 0
     
-    prompt = f"<s>[INST] <<SYS>>{system}<</SYS>>\nCONTEXT:\n{context}\n\nUSER:\n{user_text}\n[/INST]"
-    
-    out = llm(prompt, max_tokens=512, temperature=0.6, stop=["</s>", "[INST]"])
-    reply = out["choices"][0]["text"].strip()
-    return reply
\ No newline at end of file
+    started = False
+    for chunk in llm(prompt, max_tokens=max_tokens, temperature=0.6, stop=STOP_SEQUENCES, stream=True):
+        piece = chunk["choices"][0]["text"]
+        if usage is not None:
+            if not usage["completion_tokens"]:
+                usage["first_token_at"] = time.perf_counter()
+            usage["completion_tokens"] += 1
+        if not started:
+            # Match chat()'s .strip() on the leading side
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        yield piece
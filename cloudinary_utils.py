@@ -0,0 +1,123 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cloudinary
+import cloudinary.uploader
+
+# --- Cloudinary Configuration ---
+try:
+    cloudinary.config( 
+      cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME', 'dskef0sp7'), 
+      api_key = os.getenv('CLOUDINARY_API_KEY', '393697419565677'), 
+      api_secret = os.getenv('CLOUDINARY_API_SECRET', 'jAt6l0ZYCHhQSoWymLRcu5Fl5Fo'), 
+      secure = True
+    )
+    print("✅ Cloudinary initialized")
+except Exception as e:
+    print(f"❌ Cloudinary failed to initialize: {e}")
+
+def upload_file_to_cloudinary(file):
+    """
+    Uploads a file stream directly to Cloudinary and returns the public URL.
+    """
+    try:
+        file.seek(0)
+        upload_result = cloudinary.uploader.upload(
+            file,
+            folder = "ecom_products",
+            resource_type = "auto"
+        )
+        return upload_result.get("secure_url")
+    except Exception as e:
+        print(f"Error uploading file to Cloudinary: {e}")
+        return None
+
+# ---------- Background uploads with eager variants ----------
+# Generated by Cloudinary at upload time so every size is ready before the product is patched.
+# The stored URL is the eager derivative itself, so delivery never transforms on the fly.
+# A fixed WebP format instead of f_auto: f_auto is resolved per browser at delivery
+# time and would be a different (not pre-generated) derivative.
+IMAGE_VARIANTS = {
+    "thumb": {"width": 200, "height": 200, "crop": "fill", "gravity": "auto", "quality": "auto", "format": "webp"},
+    "w400": {"width": 400, "crop": "limit", "quality": "auto", "format": "webp"},
+    "w800": {"width": 800, "crop": "limit", "quality": "auto", "format": "webp"},
+}
+
+def upload_image_with_variants(path):
+    """
+    Upload a local image file and eagerly generate IMAGE_VARIANTS.
+    Returns {"image": url, "image_variants": {name: url}}; raises on failure.
+    """
+    upload_result = cloudinary.uploader.upload(
+        path,
+        folder = "ecom_products",
+        resource_type = "image",
+        eager = list(IMAGE_VARIANTS.values())
+    )
+    eager = upload_result.get("eager") or []
+    variants = {
+        name: e.get("secure_url")
+        for name, e in zip(IMAGE_VARIANTS, eager)
+        if e.get("secure_url")
+    }
+    return {"image": upload_result.get("secure_url"), "image_variants": variants}
+
+class UploadQueue:
+    """
+    Runs Cloudinary uploads off the request thread.
+    enqueue() copies the uploaded file to a temp file (the request stream is gone
+    once the response is sent) and calls on_done(result) or on_error(exc) from a
+    worker thread when the upload finishes.
+    """
+
+    def __init__(self, workers=2, retries=3):
+        self.retries = retries
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cloudinary-upload")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def enqueue(self, file, on_done, on_error=None):
+        suffix = os.path.splitext(getattr(file, "filename", "") or "")[1]
+        tmp = tempfile.NamedTemporaryFile(prefix="upload-", suffix=suffix, delete=False)
+        try:
+            file.seek(0)
+            shutil.copyfileobj(file, tmp)
+        finally:
+            tmp.close()
+        with self._lock:
+            self._pending += 1
+        self._pool.submit(self._run, tmp.name, on_done, on_error)
+
+    def _run(self, path, on_done, on_error):
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    result = upload_image_with_variants(path)
+                    break
+                except Exception as e:
+                    print(f"⚠️ Cloudinary upload attempt {attempt}/{self.retries} failed: {e}")
+                    if attempt == self.retries:
+                        if on_error:
+                            on_error(e)
+                        return
+                    time.sleep(2 ** attempt)
+            on_done(result)
+        except Exception as e:
+            print(f"❌ Upload callback failed: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
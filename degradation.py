@@ -0,0 +1,96 @@
+import threading
+import time
+
+# Degradation levels, cheapest last
+NORMAL = 0
+SHORT_REPLIES = 1     # smaller max_tokens
+NO_RAG = 2            # also drop RAG context (shorter prompt)
+SMALL_MODEL = 3       # generate with the small GGUF
+TEMPLATED_ONLY = 4    # no generation: templated product list
+
+LEVEL_NAMES = {
+    NORMAL: "normal",
+    SHORT_REPLIES: "short_replies",
+    NO_RAG: "no_rag",
+    SMALL_MODEL: "small_model",
+    TEMPLATED_ONLY: "templated_only",
+}
+
+
+class DegradationPolicy:
+    """
+    Picks a degradation level from inference load.
+    Pressure is the inference queue fill ratio (queue_depth / max_queue); each level
+    has a threshold in `queue_thresholds`. If recent tokens/sec drop below
+    `slowdown_ratio` of the long-run average (GPU/CPU contention), one extra level is
+    added. The level rises immediately but falls at most one step per `cooldown_s`,
+    so it doesn't flap around a threshold. Levels in `unavailable` (e.g. SMALL_MODEL
+    when no small model is loaded) fall back to the next lower level.
+    """
+
+    def __init__(self, queue_thresholds=(0.25, 0.5, 0.75, 0.9), slowdown_ratio=0.5,
+                 cooldown_s=10.0, unavailable=()):
+        self.queue_thresholds = tuple(queue_thresholds)
+        self.slowdown_ratio = slowdown_ratio
+        self.cooldown_s = cooldown_s
+        self.unavailable = set(unavailable)
+        self._lock = threading.Lock()
+        self._level = NORMAL
+        self._changed_at = 0.0
+        self._tps_recent = None     # fast EWMA
+        self._tps_baseline = None   # slow EWMA
+        self._served = {name: 0 for name in LEVEL_NAMES.values()}
+
+    def observe_tokens_per_sec(self, tps):
+        with self._lock:
+            if self._tps_recent is None:
+                self._tps_recent = self._tps_baseline = tps
+            else:
+                self._tps_recent += 0.3 * (tps - self._tps_recent)
+                self._tps_baseline += 0.02 * (tps - self._tps_baseline)
+
+    def _target(self, queue_depth, max_queue):
+        fill = queue_depth / max(1, max_queue)
+        target = sum(1 for t in self.queue_thresholds if fill >= t)
+        if (
+            self._tps_recent is not None
+            and self._tps_baseline
+            and self._tps_recent < self.slowdown_ratio * self._tps_baseline
+        ):
+            target += 1
+        target = min(target, TEMPLATED_ONLY)
+        # An unavailable level falls back to the next cheaper one that is available,
+        # so e.g. without a small model the service stays at NO_RAG (still answering
+        # open questions) until the TEMPLATED_ONLY threshold is reached
+        while target in self.unavailable and target > NORMAL:
+            target -= 1
+        return target
+
+    def evaluate(self, queue_depth, max_queue):
+        """Current level for a new request given the inference queue state."""
+        now = time.monotonic()
+        with self._lock:
+            target = self._target(queue_depth, max_queue)
+            if target > self._level:
+                self._level, self._changed_at = target, now
+            elif target < self._level and now - self._changed_at >= self.cooldown_s:
+                level = self._level - 1
+                while level in self.unavailable and level > target:
+                    level -= 1
+                self._level, self._changed_at = level, now
+            self._served[LEVEL_NAMES[self._level]] += 1
+            return self._level
+
+    @property
+    def level(self):
+        return self._level
+
+    def stats(self):
+        with self._lock:
+            return {
+                "level": self._level,
+                "level_name": LEVEL_NAMES[self._level],
+                "tokens_per_sec_recent": self._tps_recent,
+                "tokens_per_sec_baseline": self._tps_baseline,
+                "served": dict(self._served),
+            }
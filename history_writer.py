@@ -0,0 +1,102 @@
+import atexit
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+MAX_BATCH_OPS = 500   # Firestore limit per WriteBatch commit
+
+
+class HistoryWriter:
+    """
+    Write-behind persistence for users/{user}/chat_history.
+    record() only appends to an in-memory buffer; a background thread flushes the
+    buffer in Firestore WriteBatch commits every `flush_interval` seconds, retrying
+    with backoff while Firestore is failing. Pending messages are flushed at exit.
+    """
+
+    def __init__(self, db, flush_interval=0.5, max_buffer=10000, max_backoff=30.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_backoff = max_backoff
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "failures": 0, "dropped": 0}
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, username, role, text):
+        """Queue one chat message; returns immediately."""
+        entry = (username, {
+            "role": role,
+            "text": text,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            # Server timestamps are per commit; this keeps user/assistant order inside a batch
+            "client_created_at": datetime.now(timezone.utc),
+        })
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self._stats["dropped"] += 1
+            self._buffer.append(entry)
+            self._stats["enqueued"] += 1
+            self._cond.notify()
+
+    def _take_batch(self):
+        # caller holds the lock
+        n = min(len(self._buffer), MAX_BATCH_OPS)
+        return [self._buffer.popleft() for _ in range(n)]
+
+    def _commit(self, entries):
+        batch = self.db.batch()
+        users = self.db.collection("users")
+        for username, data in entries:
+            batch.set(users.document(username).collection("chat_history").document(), data)
+        batch.commit()
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self._cond:
+                if not self._buffer and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._buffer:
+                    return
+                entries = self._take_batch()
+            try:
+                self._commit(entries)
+            except Exception as e:
+                print(f"⚠️ Chat history flush failed ({len(entries)} messages), retrying in {backoff:.1f}s: {e}")
+                with self._cond:
+                    # Put them back at the front, in their original order
+                    self._buffer.extendleft(reversed(entries))
+                    self._stats["failures"] += 1
+                    if self._stopping:
+                        print(f"❌ Dropping {len(self._buffer)} unsaved chat history messages at shutdown")
+                        return
+                    self._cond.wait_for(lambda: self._stopping, backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.flush_interval
+            with self._cond:
+                self._stats["written"] += len(entries)
+                self._stats["batches"] += 1
+                # Let a few more messages accumulate before the next commit
+                self._cond.wait_for(lambda: self._stopping, self.flush_interval)
+
+    def close(self, timeout=10.0):
+        """Flush everything still buffered and stop the writer thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s["buffered"] = len(self._buffer)
+        return s
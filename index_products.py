@@ -0,0 +1,72 @@
+import os
+import argparse
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+import chatbot_logic
+
+DEFAULT_CHECKPOINT = os.path.join(chatbot_logic.RAG_DIR, "products_index.checkpoint.json")
+
+
+def iter_products(db, page_size=500, start_after_id=None):
+    """Yield product dicts from Firestore page by page, ordered by document id."""
+    coll = db.collection("products")
+    last_id = start_after_id
+    while True:
+        query = coll.order_by("__name__").limit(page_size)
+        if last_id:
+            query = query.start_after({"__name__": coll.document(last_id)})
+        docs = list(query.stream())
+        if not docs:
+            return
+        for doc in docs:
+            d = doc.to_dict() or {}
+            d["id"] = doc.id
+            yield d
+        last_id = docs[-1].id
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build/refresh the product semantic index in batches. Run it only while app.py is stopped: "
+                    "Chroma's store is single-process and the running app owns the index. While the app is "
+                    "running, use POST /api/admin/products/reindex instead."
+    )
+    parser.add_argument("--page-size", type=int, default=500, help="Firestore documents per read")
+    parser.add_argument("--batch-size", type=int, default=256, help="products per embedding batch")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="embedding threads")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="checkpoint file used to resume")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and index everything")
+    args = parser.parse_args()
+
+    cred = credentials.Certificate("serviceAccountKey.json")
+    firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    checkpoint = None if args.restart else chatbot_logic.load_index_checkpoint(args.checkpoint)
+    start_after_id = checkpoint["last_id"] if checkpoint else None
+    already_indexed = checkpoint["indexed"] if checkpoint else 0
+    if checkpoint:
+        print(f"↩️  Resuming after product {start_after_id} ({already_indexed} already indexed)")
+
+    client = chatbot_logic.get_chroma_client(chatbot_logic.RAG_DIR)
+    coll = client.get_or_create_collection("products", embedding_function=chatbot_logic.get_embedding_function())
+
+    chatbot_logic.index_products_batched(
+        iter_products(db, page_size=args.page_size, start_after_id=start_after_id),
+        coll,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        already_indexed=already_indexed,
+    )
+
+    # Finished cleanly: next run starts from the beginning
+    if os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+    print(f"🎉 Product index ready. Items indexed: {coll.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import threading
+from itertools import islice
+
+import chatbot_logic
+
+MAX_BATCH = 1000   # products per upsert_products call
+
+
+class ProductIndexSync:
+    """
+    Write-behind sync from catalog changes to the product semantic index.
+    on_catalog_change() only records the latest change per product; a background
+    thread applies them every `flush_interval` seconds with one batched
+    upsert_products / delete_products call per batch, so a bulk import doesn't embed
+    row by row on the Firestore listener thread. Changes that arrive while the index
+    is not loaded yet (coll_fn() returns None) are dropped: the startup sync catches up.
+    """
+
+    def __init__(self, coll_fn, flush_interval=0.5, max_backoff=30.0):
+        self.coll_fn = coll_fn
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._pending = {}   # product id -> product dict, or None for a removal
+        self._cond = threading.Condition()
+        self._stats = {"changes": 0, "embedded": 0, "metadata_only": 0, "deleted": 0, "batches": 0, "failures": 0}
+        self._thread = threading.Thread(target=self._run, name="product-index-sync", daemon=True)
+        self._thread.start()
+
+    def on_catalog_change(self, kind, pid, product):
+        """CatalogCache subscriber; returns immediately."""
+        if self.coll_fn() is None:
+            return
+        with self._cond:
+            self._pending[pid] = None if kind == "remove" else product
+            self._stats["changes"] += 1
+            self._cond.notify()
+
+    def _take_batch(self):
+        # caller holds the lock
+        batch = {}
+        for pid in list(islice(self._pending, MAX_BATCH)):
+            batch[pid] = self._pending.pop(pid)
+        return batch
+
+    def _apply(self, batch):
+        coll = self.coll_fn()
+        upserts = [p for p in batch.values() if p is not None]
+        removed = [pid for pid, p in batch.items() if p is None]
+        embedded, metadata_only = chatbot_logic.upsert_products(coll, upserts)
+        deleted = chatbot_logic.delete_products(coll, removed)
+        return embedded, metadata_only, deleted
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self._cond:
+                # Let a burst of listener changes accumulate before embedding
+                self._cond.wait_for(lambda: self._pending)
+                self._cond.wait(self.flush_interval)
+                batch = self._take_batch()
+            try:
+                embedded, metadata_only, deleted = self._apply(batch)
+            except Exception as e:
+                print(f"⚠️ Product index sync failed ({len(batch)} changes), retrying in {backoff:.1f}s: {e}")
+                with self._cond:
+                    # Newer changes for the same product win over the failed ones
+                    for pid, product in batch.items():
+                        self._pending.setdefault(pid, product)
+                    self._stats["failures"] += 1
+                    self._cond.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.flush_interval
+            with self._cond:
+                self._stats["embedded"] += embedded
+                self._stats["metadata_only"] += metadata_only
+                self._stats["deleted"] += deleted
+                self._stats["batches"] += 1
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s["pending"] = len(self._pending)
+        return s
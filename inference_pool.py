@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+
+
+class PoolBusy(Exception):
+    """Raised when the inference queue is full; callers should answer 503 + Retry-After."""
+
+
+class InferenceTimeout(Exception):
+    """Raised when a request did not finish (or start streaming) within its timeout."""
+
+
+class _Job:
+    def __init__(self, fn):
+        self.fn = fn
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class InferencePool:
+    """
+    Bounded scheduler in front of one or more Llama instances.
+    Each worker thread owns exactly one model replica, so a llama.cpp object is
+    never used by two threads at once. Jobs are callables fn(llm) queued in a
+    bounded FIFO; submit() fails fast with PoolBusy when the queue is full.
+    """
+
+    def __init__(self, models, max_queue=8, default_timeout=120.0):
+        if not models:
+            raise ValueError("InferencePool needs at least one model")
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+        }
+        self._workers = []
+        for i, llm in enumerate(models):
+            t = threading.Thread(target=self._worker, args=(llm,), name=f"llm-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    # ---------- worker ----------
+    def _worker(self, llm):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancelled:
+                    continue
+                job.started_at = time.monotonic()
+                wait = job.started_at - job.enqueued_at
+                with self._lock:
+                    self._busy += 1
+                    self._stats["wait_seconds_total"] += wait
+                    self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+                try:
+                    job.result = job.fn(llm)
+                    ok = True
+                except Exception as e:
+                    job.error = e
+                    ok = False
+                run = time.monotonic() - job.started_at
+                with self._lock:
+                    self._busy -= 1
+                    self._stats["run_seconds_total"] += run
+                    self._stats["completed" if ok else "failed"] += 1
+                job.done.set()
+            finally:
+                self._queue.task_done()
+
+    # ---------- client API ----------
+    def submit(self, fn):
+        """Queue fn(llm) without waiting. Raises PoolBusy if the queue is full."""
+        return self._enqueue(_Job(fn))
+
+    def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PoolBusy(f"inference queue full ({self.max_queue} waiting)")
+        with self._lock:
+            self._stats["submitted"] += 1
+        return job
+
+    def run(self, fn, timeout=None):
+        """Queue fn(llm) and block until it finishes. Raises PoolBusy / InferenceTimeout."""
+        job = self.submit(fn)
+        return self.wait(job, timeout)
+
+    def wait(self, job, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        if not job.done.wait(timeout):
+            # A queued job is dropped; a running one finishes but nobody reads it
+            job.cancelled = True
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise InferenceTimeout(f"inference did not finish within {timeout:.0f}s")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stream(self, gen_fn, timeout=None):
+        """
+        Run a generator function gen_fn(llm) on a worker and yield its items on the
+        calling thread. timeout bounds the wait for each item (including the first,
+        which covers queueing and prompt evaluation).
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        items = queue.Queue()
+        _end = object()
+
+        job = _Job(None)
+
+        def run(llm):
+            try:
+                for item in gen_fn(llm):
+                    if job.cancelled:
+                        break
+                    items.put(item)
+            finally:
+                items.put(_end)
+
+        job.fn = run
+        self._enqueue(job)
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=timeout)
+                except queue.Empty:
+                    job.cancelled = True
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise InferenceTimeout(f"no tokens within {timeout:.0f}s")
+                if item is _end:
+                    break
+                yield item
+        finally:
+            # Client went away or timed out: stop generating on the worker
+            job.cancelled = True
+        job.done.wait(timeout)
+        if job.error is not None:
+            raise job.error
+
+    def is_full(self):
+        return self._queue.full()
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up, for the Retry-After header."""
+        s = self.stats()
+        avg_run = s["avg_run_seconds"] or 5.0
+        return max(1, int(avg_run * (s["queue_depth"] + 1) / max(1, s["workers"])))
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            busy = self._busy
+        started = s["completed"] + s["failed"]
+        s.update({
+            "workers": len(self._workers),
+            "busy_workers": busy,
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "avg_wait_seconds": (s["wait_seconds_total"] / started) if started else 0.0,
+            "avg_run_seconds": (s["run_seconds_total"] / started) if started else 0.0,
+        })
+        return s
@@ -0,0 +1,25 @@
+import os
+import argparse
+
+import chatbot_logic
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally ingest rag/docs into the RAG index (only new, changed and deleted files). "
+                    "While app.py is running, use POST /api/admin/rag/ingest instead so the live index and "
+                    "response cache pick up the change."
+    )
+    parser.add_argument("--docs-dir", default=chatbot_logic.DOCS_DIR, help="directory with .txt/.md documents")
+    parser.add_argument("--index-dir", default=chatbot_logic.RAG_DIR, help="Chroma index directory")
+    parser.add_argument("--workers", type=int, default=max(1, os.cpu_count() or 2), help="processes for splitting changed documents")
+    args = parser.parse_args()
+
+    coll, stats = chatbot_logic.ingest_rag_docs(docs_dir=args.docs_dir, path=args.index_dir, workers=args.workers)
+    print(f"📚 {stats['files']} docs: {stats['changed']} changed, {stats['deleted']} deleted, "
+          f"+{stats['chunks_added']} / -{stats['chunks_removed']} chunks in {stats['seconds']}s")
+    print(f"🎉 RAG index ready. Chunks indexed: {coll.count()}")
+
+
+if __name__ == "__main__":
+    main()
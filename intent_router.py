@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+
+PRODUCT_LOOKUP = "product_lookup"
+OPEN_QUESTION = "open_question"
+
+# Short, typical phrasings per intent; the query is compared with each of them
+DEFAULT_PROTOTYPES = {
+    PRODUCT_LOOKUP: [
+        "show me shoes under 150",
+        "do you have yoga mats",
+        "I'm looking for a wireless mouse",
+        "find me a red dress",
+        "any laptops in stock",
+        "what headphones do you sell",
+        "list your skincare products",
+        "cheap running shoes for men",
+        "products in the electronics category",
+        "do you sell phone chargers",
+        "show me bags for women",
+        "what snacks do you have",
+    ],
+    OPEN_QUESTION: [
+        "what is your return policy",
+        "how long does shipping take",
+        "which of these is better for a beginner",
+        "can you compare these two phones",
+        "how do I track my order",
+        "hello, how are you",
+        "thank you for your help",
+        "what payment methods do you accept",
+        "is this jacket warm enough for winter",
+        "tell me about your store",
+        "why was my order cancelled",
+        "how do I use this product",
+    ],
+}
+
+
+def _unit_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IntentRouter:
+    """
+    Nearest-prototype intent classifier on top of the query embedding model.
+    classify() compares the query vector with every prototype phrase; a query is a
+    product lookup when its best lookup prototype is at least `min_similarity` and
+    beats the best open-question prototype by `margin`. Anything else is open.
+    """
+
+    def __init__(self, embed_fn, prototypes=None, min_similarity=0.6, margin=0.03):
+        self.embed_fn = embed_fn
+        self.prototypes = prototypes or DEFAULT_PROTOTYPES
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._labels = None
+        self._stats = {intent: 0 for intent in self.prototypes}
+
+    def warm(self):
+        """Embed the prototype phrases (done lazily on first classify otherwise)."""
+        with self._lock:
+            if self._matrix is not None:
+                return
+            labels, texts = [], []
+            for intent, phrases in self.prototypes.items():
+                labels.extend([intent] * len(phrases))
+                texts.extend(phrases)
+            self._matrix = _unit_rows(self.embed_fn(texts))
+            self._labels = np.array(labels)
+
+    def classify(self, query, vector=None):
+        """Return (intent, {intent: best similarity}) for the query (or its precomputed vector)."""
+        self.warm()
+        if vector is None:
+            vector = self.embed_fn([query])[0]
+        sims = self._matrix @ _unit_rows([vector])[0]
+        best = {intent: float(sims[self._labels == intent].max()) for intent in self.prototypes}
+
+        lookup = best.get(PRODUCT_LOOKUP, 0.0)
+        others = max((s for intent, s in best.items() if intent != PRODUCT_LOOKUP), default=0.0)
+        intent = PRODUCT_LOOKUP if lookup >= self.min_similarity and lookup - others >= self.margin else OPEN_QUESTION
+        with self._lock:
+            self._stats[intent] = self._stats.get(intent, 0) + 1
+        return intent, best
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,180 @@
+import math
+import re
+import threading
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that carry no product information in chat queries ("do you have a yoga mat?")
+FILLER_WORDS = frozenset(
+    "a an the any some do does you have has got sell show me find looking for i im want need "
+    "please is there are your can could get buy".split()
+)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or "").lower())
+
+
+def normalize(text):
+    """Token-joined form used for exact name / SKU comparison ("USB-C Power Bank" -> "usb c power bank")."""
+    return " ".join(tokenize(text))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked id lists into one: score(id) = sum 1 / (k + rank).
+    Returns ids ordered by fused score (ties keep first-seen order).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, pid in enumerate(ranking, 1):
+            scores[pid] = scores.get(pid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda pid: -scores[pid])
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over product name, SKU, category and description.
+    Name tokens are counted `name_boost` times so title matches outrank description
+    mentions. Updated per product (upsert/remove), so it can follow CatalogCache
+    changes; exact() answers "the query is a product name / SKU" without scoring.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, name_boost=2):
+        self.k1 = k1
+        self.b = b
+        self.name_boost = name_boost
+        self._lock = threading.RLock()
+        self._postings = {}      # term -> {product id: term frequency}
+        self._doc_terms = {}     # product id -> Counter of terms
+        self._doc_len = {}       # product id -> number of terms
+        self._total_len = 0
+        self._exact = {}         # normalized name / sku -> set of product ids
+        self._doc_keys = {}      # product id -> its exact keys
+
+    # ---------- writes ----------
+    def _terms(self, product):
+        terms = Counter()
+        for _ in range(self.name_boost):
+            terms.update(tokenize(product.get("name")))
+        terms.update(tokenize(product.get("sku")))
+        terms.update(tokenize(product.get("category")))
+        terms.update(tokenize(product.get("description")))
+        return terms
+
+    def _exact_keys(self, product):
+        return {k for k in (normalize(product.get("name")), normalize(product.get("sku"))) if k}
+
+    def _remove_locked(self, pid):
+        terms = self._doc_terms.pop(pid, None)
+        if terms is None:
+            return False
+        for term in terms:
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(pid, None)
+                if not docs:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(pid)
+        for key in self._doc_keys.pop(pid, ()):
+            ids = self._exact.get(key)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self._exact[key]
+        return True
+
+    def upsert(self, pid, product):
+        terms = self._terms(product)
+        with self._lock:
+            self._remove_locked(pid)
+            self._doc_terms[pid] = terms
+            self._doc_len[pid] = sum(terms.values())
+            self._total_len += self._doc_len[pid]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[pid] = tf
+            self._doc_keys[pid] = self._exact_keys(product)
+            for key in self._doc_keys[pid]:
+                self._exact.setdefault(key, set()).add(pid)
+
+    def remove(self, pid):
+        with self._lock:
+            return self._remove_locked(pid)
+
+    def rebuild(self, products):
+        """Replace the whole index with `products` (dicts with an "id")."""
+        fresh = LexicalIndex(self.k1, self.b, self.name_boost)
+        for p in products:
+            if p.get("id"):
+                fresh.upsert(str(p["id"]), p)
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._doc_len = fresh._doc_len
+            self._total_len = fresh._total_len
+            self._exact = fresh._exact
+            self._doc_keys = fresh._doc_keys
+
+    def on_catalog_change(self, kind, pid, product):
+        """CatalogCache subscriber."""
+        if kind == "remove":
+            self.remove(pid)
+        else:
+            self.upsert(pid, product)
+
+    # ---------- reads ----------
+    def exact(self, query):
+        """
+        Product ids whose name or SKU equals the query, ignoring case, punctuation
+        and filler words ("do you have the Yoga Mat?"). Empty list if none.
+        """
+        with self._lock:
+            ids = self._exact.get(normalize(query))
+            if not ids:
+                core = " ".join(t for t in tokenize(query) if t not in FILLER_WORDS)
+                ids = self._exact.get(core) if core else None
+            return sorted(ids) if ids else []
+
+    def _expand_prefix(self, token, limit):
+        # caller holds the lock; most common completions first
+        matches = [t for t in self._postings if t.startswith(token)]
+        matches.sort(key=lambda t: -len(self._postings[t]))
+        return matches[:limit]
+
+    def search(self, query, k=10, accept=None, prefix=False, prefix_terms=32):
+        """
+        BM25-ranked [(product id, score)], best first.
+        accept: optional predicate on product id (e.g. a metadata filter).
+        prefix: the last query token also matches terms that start with it
+        (search-as-you-type: "yog" finds "yoga"), up to `prefix_terms` completions.
+        """
+        tokens = tokenize(query)
+        terms = set(tokens)
+        with self._lock:
+            n = len(self._doc_terms)
+            if not n or not terms:
+                return []
+            if prefix:
+                terms.update(self._expand_prefix(tokens[-1], prefix_terms))
+            avg_len = self._total_len / n
+            scores = {}
+            for term in terms:
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for pid, tf in docs.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[pid] / avg_len)
+                    scores[pid] = scores.get(pid, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+        if accept is not None:
+            ranked = [(pid, s) for pid, s in ranked if accept(pid)]
+        return ranked[:k]
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._doc_terms), "terms": len(self._postings)}
+
+    def __len__(self):
+        return len(self._doc_terms)
@@ -0,0 +1,63 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into batched calls.
+    Items submitted within `max_wait_ms` of the first one (up to `max_batch`) are
+    passed together to fn(items), which must return one result per item in order.
+    Each caller gets its own result (or the batch's exception) through a Future.
+    """
+
+    def __init__(self, fn, max_batch=32, max_wait_ms=2.0, name="micro-batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats = {"batches": 0, "items": 0, "max_batch_seen": 0}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+
+            self._stats["batches"] += 1
+            self._stats["items"] += len(items)
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(items))
+
+    def stats(self):
+        s = dict(self._stats)
+        s["avg_batch"] = (s["items"] / s["batches"]) if s["batches"] else 0.0
+        s["queued"] = self._queue.qsize()
+        return s
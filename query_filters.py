@@ -0,0 +1,146 @@
+import re
+
+# Most specific first: constraints dropped earliest when nothing matches
+RELAXATION_ORDER = ("color", "in_stock", "gender", "category", "price")
+
+_NUM = r"(?:rm|myr|\$)?\s*(\d+(?:\.\d+)?)\s*(?:rm|myr|ringgit)?"
+_AMOUNT = r"(?<![\d.])(\d+(?:\.\d+)?)"
+# A number pair is a price range only when phrased as one or when the currency is
+# attached to the pair itself; a bare "13-15" is more likely a model number
+_PHRASED_RANGE_RE = re.compile(rf"\b(?:between|from)\s+{_NUM}\s*(?:-|to|and)\s*{_NUM}")
+_PRICED_RANGE_RE = re.compile(
+    rf"(?:rm|myr|\$)\s*{_AMOUNT}\s*(?:-|to)\s*(?:rm|myr|\$)?\s*{_AMOUNT}"
+    rf"|{_AMOUNT}\s*(?:-|to)\s*{_AMOUNT}\s*(?:rm|myr|ringgit)\b(?!\s*\d)"
+)
+_MAX_RE = re.compile(rf"(?:under|below|less than|cheaper than|up to|at most|budget(?: of)?|<=?)\s*{_NUM}")
+_MIN_RE = re.compile(rf"(?:over|above|more than|at least|from|>=?)\s*{_NUM}")
+
+_MALE = {"men", "mens", "man", "male", "guy", "guys", "boys", "him"}
+_FEMALE = {"women", "womens", "woman", "female", "ladies", "lady", "girls", "her"}
+_IN_STOCK = ("in stock", "available now", "ready stock", "can ship", "not sold out")
+
+
+def _tokens(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def price_value(value):
+    """Price as a float, or None if it is missing or not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_price(ql):
+    m = _PHRASED_RANGE_RE.search(ql) or _PRICED_RANGE_RE.search(ql)
+    if m:
+        lo, hi = sorted(float(g) for g in m.groups() if g is not None)
+        return {"price_min": lo, "price_max": hi}
+    # explicit bounds ("under rm 2000"); bare number pairs are ignored
+    out = {}
+    m = _MAX_RE.search(ql)
+    if m:
+        out["price_max"] = float(m.group(1))
+    m = _MIN_RE.search(ql)
+    if m:
+        out["price_min"] = float(m.group(1))
+    return out
+
+
+def _find_phrase(value, query_tokens_text):
+    phrase = " ".join(_tokens(value))
+    return bool(phrase) and re.search(rf"\b{re.escape(phrase)}s?\b", query_tokens_text) is not None
+
+
+def parse_query_filters(query, categories=(), colors=()):
+    """
+    Structured filters mentioned in a shopping query.
+    categories / colors are the values that exist in the live catalog; only those
+    can match. Returns a dict with any of: price_min, price_max, category, gender,
+    in_stock, color.
+    """
+    if not query:
+        return {}
+    ql = query.lower()
+    toks = _tokens(ql)
+    tok_set = set(toks)
+    text = " ".join(toks)
+    filters = _parse_price(ql)
+
+    if tok_set & _FEMALE:
+        filters["gender"] = "female"
+    elif tok_set & _MALE:
+        filters["gender"] = "male"
+
+    if any(p in ql for p in _IN_STOCK):
+        filters["in_stock"] = True
+
+    # Longest names first so "Home & Living" wins over a shorter overlapping name
+    for category in sorted(categories, key=lambda c: -len(c)):
+        if _find_phrase(category, text):
+            filters["category"] = category
+            break
+
+    for color in sorted(colors, key=lambda c: -len(str(c))):
+        if _find_phrase(str(color), text):
+            filters["color"] = color
+            break
+    return filters
+
+
+def product_matches(product, filters):
+    """Apply parsed filters to a catalog product dict (same semantics as to_where)."""
+    if not filters:
+        return True
+    if "price_min" in filters or "price_max" in filters:
+        price = price_value(product.get("price"))
+        if price is None:
+            return False
+        if "price_min" in filters and price < filters["price_min"]:
+            return False
+        if "price_max" in filters and price > filters["price_max"]:
+            return False
+    for key in ("category", "gender", "color"):
+        if key in filters and product.get(key) != filters[key]:
+            return False
+    if filters.get("in_stock") and product.get("in_stock") is not True:
+        return False
+    return True
+
+
+def to_facets(filters):
+    """Keyword arguments for CatalogCache.has_match (same semantics as product_matches)."""
+    equals = {k: filters[k] for k in ("category", "gender", "color") if k in filters}
+    if filters.get("in_stock"):
+        equals["in_stock"] = True
+    return {"equals": equals, "price_min": filters.get("price_min"), "price_max": filters.get("price_max")}
+
+def to_where(filters):
+    """Chroma where clause for parsed filters (None when there is nothing to filter on)."""
+    clauses = []
+    if "price_min" in filters:
+        clauses.append({"price": {"$gte": filters["price_min"]}})
+    if "price_max" in filters:
+        clauses.append({"price": {"$lte": filters["price_max"]}})
+    for key in ("category", "gender", "color", "in_stock"):
+        if key in filters:
+            clauses.append({key: filters[key]})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def relaxations(filters):
+    """
+    Filter sets from strictest to loosest: the full set, then dropping one
+    constraint at a time in RELAXATION_ORDER, ending with no filters.
+    """
+    current = dict(filters)
+    yield dict(current)
+    for key in RELAXATION_ORDER:
+        names = ("price_min", "price_max") if key == "price" else (key,)
+        if any(n in current for n in names):
+            for n in names:
+                current.pop(n, None)
+            yield dict(current)
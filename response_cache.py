@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _normalize_text(text):
+    return " ".join((text or "").lower().split())
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class SemanticResponseCache:
+    """
+    LRU + TTL cache of chat replies keyed on the query embedding.
+    A lookup hits when a stored query is within `threshold` cosine similarity of
+    the new one (exact repeats hit without embedding at all). Entries belong to a
+    scope, e.g. (catalog_version, rag_version); when the scope changes the whole
+    cache is dropped, so catalog edits never serve stale answers.
+    """
+
+    def __init__(self, embed_fn, threshold=0.92, max_entries=512, ttl_seconds=3600):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # normalized query -> (unit vector, reply, created_at)
+        self._scope = None
+        self._stats = {"hits": 0, "exact_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def embed(self, query):
+        return self.embed_fn([query])[0]
+
+    def _check_scope(self, scope):
+        # caller holds the lock
+        if scope != self._scope:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._scope = scope
+
+    def _expire(self, now):
+        # caller holds the lock; OrderedDict is in LRU order, not age order, so scan
+        expired = [k for k, (_, _, created) in self._entries.items() if now - created > self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+        self._stats["expirations"] += len(expired)
+
+    def lookup(self, query, scope, vector=None):
+        """
+        Return (reply or None, query vector). The vector is None for exact-text hits;
+        on a miss it is the raw query embedding and can be passed on to store()
+        and to retrieval.
+        """
+        key = _normalize_text(query)
+        now = time.time()
+        with self._lock:
+            self._check_scope(scope)
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["exact_hits"] += 1
+                return entry[1], None
+
+        if vector is None:
+            vector = self.embed(query)
+        unit = _unit(vector)
+
+        with self._lock:
+            if scope != self._scope or not self._entries:
+                self._stats["misses"] += 1
+                return None, vector
+            keys = list(self._entries)
+            matrix = np.stack([self._entries[k][0] for k in keys])
+            sims = matrix @ unit
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                self._entries.move_to_end(keys[best])
+                self._stats["hits"] += 1
+                return self._entries[keys[best]][1], vector
+            self._stats["misses"] += 1
+            return None, vector
+
+    def store(self, query, reply, scope, vector=None):
+        if not reply:
+            return
+        if vector is None:
+            vector = self.embed(query)
+        key = _normalize_text(query)
+        with self._lock:
+            self._check_scope(scope)
+            self._entries[key] = (_unit(vector), reply, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._entries)
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = (s["hits"] / lookups) if lookups else 0.0
+        return s
@@ -0,0 +1,9 @@
+from query_filters import parse_query_filters
+
+
+def test_model_number_pair_is_not_a_price_range():
+    assert parse_query_filters("iphone 13-15 under rm 2000") == {"price_max": 2000.0}
+
+
+def test_from_to_range_keeps_both_bounds():
+    assert parse_query_filters("running shoes from 100 to 200") == {"price_min": 100.0, "price_max": 200.0}